@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Polarify benchmarks
+
+Times the hot paths of polarify.py offline: color extraction (every
+palette extractor, with its quantization error), theme generation,
+contrast solving, template updates and full theme applies.
+Everything runs against synthetic wallpapers and a temporary copy of the
+repository, with GSettings replaced by an in-memory stub and sassc by a
+script that copies its input, so nothing on the desktop is touched.
+
+Each case runs in its own process so its peak RSS is measured in isolation.
+Results are printed (or written with --output) as JSON:
+
+    benchmarks/bench_polarify.py --repeat 10 --output before.json
+    benchmarks/bench_polarify.py --only apply_theme --resolutions 4k
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+    "8k": (7680, 4320),
+}
+
+# Files and directories apply_theme reads or writes, relative to base_dir
+BASE_DIR_CONTENT = [
+    "themes",
+    "theme-config.json",
+    "ghostty/themes",
+    "gtk-4.0",
+    "gnome-shell-theme",
+]
+
+USER_THEME_SCHEMAS = (".local/share/gnome-shell/extensions/"
+                      "user-theme@gnome-shell-extensions.gcampax.github.com/schemas")
+
+THEMES = ("bearded_arc", "bearded_monokai_stone")
+
+
+# --- Workspace ---------------------------------------------------------------
+
+def make_wallpaper(path: Path, size, seed: int):
+    """Write a JPEG with smooth color fields and noise, like a photo wallpaper."""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    width, height = size
+    field = Image.fromarray(rng.integers(0, 256, (9, 16, 3), dtype=np.uint8))
+    img = field.resize((width, height), Image.BICUBIC)
+    noise = rng.integers(-12, 13, (height, width, 1), dtype=np.int16)
+    pixels = np.clip(np.asarray(img, dtype=np.int16) + noise, 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).save(path, quality=90)
+
+
+def prepare_workspace(workdir: Path, resolutions):
+    """Copy the theme sources into workdir and create wallpapers and tool stubs."""
+    base_dir = workdir / "base"
+    for entry in BASE_DIR_CONTENT:
+        source = REPO_DIR / entry
+        if source.is_dir():
+            shutil.copytree(source, base_dir / entry)
+        elif source.exists():
+            (base_dir / entry).parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(source, base_dir / entry)
+    (base_dir / "gtk-4.0/themes").mkdir(parents=True, exist_ok=True)
+
+    (workdir / "home" / USER_THEME_SCHEMAS).mkdir(parents=True)
+    (workdir / "cache").mkdir()
+
+    # sassc stand-in: polarify calls `sassc -a <input> <output>`
+    bin_dir = workdir / "bin"
+    bin_dir.mkdir()
+    sassc = bin_dir / "sassc"
+    sassc.write_text('#!/bin/sh\ncat "$2" > "$3"\n')
+    sassc.chmod(0o755)
+
+    images = workdir / "images"
+    images.mkdir()
+    for seed, name in enumerate(resolutions):
+        make_wallpaper(images / f"{name}.jpg", RESOLUTIONS[name], seed)
+
+
+def case_environment(workdir: Path) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "HOME": str(workdir / "home"),
+        "XDG_CACHE_HOME": str(workdir / "cache"),
+        "XDG_RUNTIME_DIR": str(workdir),
+        "XDG_CURRENT_DESKTOP": "GNOME",
+        "PATH": f"{workdir / 'bin'}{os.pathsep}{env.get('PATH', '')}",
+    })
+    return env
+
+
+# --- GSettings stub ----------------------------------------------------------
+
+class StubSettings:
+    """In-memory Gio.Settings emitting 'changed' like the real thing."""
+
+    def __init__(self, schema: str, values: dict):
+        self.schema = schema
+        self.values = values
+        self.handlers = []
+        self.delayed = None
+
+    def connect(self, signal, handler, *args):
+        self.handlers.append((handler, args))
+        return len(self.handlers)
+
+    def disconnect(self, handler_id):
+        self.handlers[handler_id - 1] = (lambda *a: None, ())
+
+    def _set(self, key, value):
+        if self.delayed is not None:
+            self.delayed[key] = value
+            return True
+        changed = self.values.get(key) != value
+        self.values[key] = value
+        if changed:
+            for handler, args in list(self.handlers):
+                handler(self, key, *args)
+        return True
+
+    def get_string(self, key):
+        return self.values.get(key, "")
+
+    def get_boolean(self, key):
+        return bool(self.values.get(key, False))
+
+    def set_string(self, key, value):
+        return self._set(key, value)
+
+    def set_boolean(self, key, value):
+        return self._set(key, value)
+
+    def reset(self, key):
+        self._set(key, "")
+
+    def delay(self):
+        self.delayed = {}
+
+    def apply(self):
+        pending, self.delayed = self.delayed or {}, None
+        for key, value in pending.items():
+            self._set(key, value)
+
+    def revert(self):
+        self.delayed = None
+
+    def sync(self):
+        pass
+
+
+def stub_gio(wallpaper_uri: str) -> SimpleNamespace:
+    """A Gio namespace covering what polarify uses outside the watchers."""
+    store = {
+        "org.gnome.desktop.interface": {"color-scheme": "prefer-dark"},
+        "org.gnome.desktop.a11y.interface": {"high-contrast": False},
+        "org.gnome.desktop.background": {"picture-uri": wallpaper_uri,
+                                         "picture-uri-dark": wallpaper_uri},
+        "org.gnome.shell.extensions.user-theme": {"name": ""},
+    }
+    settings = {}
+
+    def new(schema):
+        if schema not in settings:
+            settings[schema] = StubSettings(schema, store.setdefault(schema, {}))
+        return settings[schema]
+
+    schema_source = SimpleNamespace(lookup=lambda schema, recursive: schema)
+    return SimpleNamespace(
+        Settings=SimpleNamespace(new=new, new_full=lambda schema, backend, path: new(schema)),
+        SettingsSchemaSource=SimpleNamespace(
+            new_from_directory=lambda directory, parent, trusted: schema_source,
+            get_default=lambda: None,
+        ),
+    )
+
+
+def stub_glib() -> SimpleNamespace:
+    """The GLib pieces used while applying: an always-idle default main context."""
+    context = SimpleNamespace(pending=lambda: False, iteration=lambda may_block: False)
+    return SimpleNamespace(MainContext=SimpleNamespace(default=lambda: context),
+                           idle_add=lambda fn, *args: fn(*args))
+
+
+# --- Cases -------------------------------------------------------------------
+#
+# A case builder takes the polarify module, a ThemeManager on the workspace and
+# the wallpaper path, and returns (run, setup) or (run, setup, metrics): run()
+# is timed, setup() runs untimed before every sample, and metrics(result) adds
+# fields computed from the last run's return value.
+
+def import_polarify():
+    if str(REPO_DIR) not in sys.path:
+        sys.path.insert(0, str(REPO_DIR))
+    import polarify
+    return polarify
+
+
+def load_polarify(workdir: Path, resolution: str):
+    polarify = import_polarify()
+
+    wallpaper = workdir / "images" / f"{resolution}.jpg"
+    polarify.Gio = stub_gio(wallpaper.as_uri())
+    polarify.GLib = stub_glib()
+    polarify.GNOME_AVAILABLE = True
+    manager = polarify.ThemeManager(base_dir=workdir / "base")
+    return polarify, manager, wallpaper
+
+
+def case_extract(method):
+    def build(polarify, manager, wallpaper):
+        if method == "sklearn" and not polarify._available("sklearn"):
+            raise SkipCase("scikit-learn is not installed")
+        generator = polarify.ImageThemeGenerator
+
+        def metrics(palette):
+            """Mean OKLab distance from each analysed pixel to its nearest palette color."""
+            np = polarify.np
+            pixels = np.asarray(generator.load_analysis_image(str(wallpaper))).reshape(-1, 3)
+            lab = polarify.ColorSpace.srgb_to_oklab(pixels.astype(np.float64))
+            centers = polarify.ColorSpace.srgb_to_oklab(
+                polarify.ColorEngine.to_array([color for color, _ in palette]))
+            error = np.sqrt(((lab[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)).min(axis=1)
+            return {"colors": len(palette), "mean_oklab_error": round(float(error.mean()), 5)}
+
+        return (lambda: generator.extract_weighted_colors(str(wallpaper), 12, method)), None, metrics
+    return build
+
+
+def case_generate(polarify, manager, wallpaper):
+    return (lambda: polarify.ImageThemeGenerator.generate_theme_from_image(
+        str(wallpaper), "wallpaper", "dark")), None
+
+
+def case_ensure_contrast(polarify, manager, wallpaper):
+    rng = random.Random(0)
+    pairs = [("#%06x" % rng.randrange(1 << 24), "#%06x" % rng.randrange(1 << 24))
+             for _ in range(200)]
+
+    def run():
+        for fg, bg in pairs:
+            polarify.ImageThemeGenerator.ensure_contrast(fg, bg, 4.5)
+    return run, None
+
+
+def alternating_themes(manager):
+    themes = [manager.load_theme(name) for name in THEMES]
+    state = {"i": 0}
+
+    def next_theme():
+        state["i"] += 1
+        return themes[state["i"] % len(themes)]
+    return next_theme
+
+
+def case_update_gtk(polarify, manager, wallpaper):
+    next_theme = alternating_themes(manager)
+    return (lambda: manager.update_gtk(next_theme())), None
+
+
+def case_update_gnome_shell(polarify, manager, wallpaper):
+    next_theme = alternating_themes(manager)
+    return (lambda: manager.update_gnome_shell(next_theme())), None
+
+
+def case_install_gnome_shell(polarify, manager, wallpaper):
+    next_theme = alternating_themes(manager)
+    return (lambda: manager.install_gnome_shell(next_theme())), manager.shell_css_cache.clear
+
+
+def case_apply_theme(polarify, manager, wallpaper):
+    state = {"i": 0}
+
+    def run():
+        state["i"] += 1
+        manager.apply_theme(THEMES[state["i"] % len(THEMES)])
+    return run, None
+
+
+def case_apply_wallpaper(cached):
+    def build(polarify, manager, wallpaper):
+        def setup():
+            config = manager.load_config()
+            config.pop("fingerprints", None)
+            manager.save_config(config)
+            if not cached:
+                manager.theme_cache.clear()
+                manager.shell_css_cache.clear()
+                manager.file_hashes = polarify.FileChangeDetector()
+        return (lambda: manager.apply_theme("wallpaper", variant="dark")), setup
+    return build
+
+
+class SkipCase(Exception):
+    pass
+
+
+def case_table(resolutions):
+    """All cases as {name: (builder, resolution)}."""
+    largest = max(resolutions, key=lambda name: RESOLUTIONS[name][0])
+    cases = {}
+    for res in resolutions:
+        for method in import_polarify().PALETTE_EXTRACTORS:
+            cases[f"extract_dominant_colors[{method},{res}]"] = (case_extract(method), res)
+        cases[f"generate_theme_from_image[{res}]"] = (case_generate, res)
+    cases["ensure_contrast[x200]"] = (case_ensure_contrast, largest)
+    cases["update_gtk"] = (case_update_gtk, largest)
+    cases["update_gnome_shell"] = (case_update_gnome_shell, largest)
+    cases["install_gnome_shell[uncached]"] = (case_install_gnome_shell, largest)
+    cases["apply_theme[bundled]"] = (case_apply_theme, largest)
+    for res in resolutions:
+        cases[f"apply_theme[wallpaper,uncached,{res}]"] = (case_apply_wallpaper(False), res)
+    cases[f"apply_theme[wallpaper,cached,{largest}]"] = (case_apply_wallpaper(True), largest)
+    return cases
+
+
+# --- Running -----------------------------------------------------------------
+
+def percentile(samples, q: float) -> float:
+    """Linearly interpolated percentile of an already sorted list."""
+    if len(samples) == 1:
+        return samples[0]
+    pos = (len(samples) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(samples) - 1)
+    return samples[lo] + (samples[hi] - samples[lo]) * (pos - lo)
+
+
+def summarize(samples_ms):
+    ordered = sorted(samples_ms)
+    return {
+        "n": len(ordered),
+        "min_ms": ordered[0],
+        "mean_ms": sum(ordered) / len(ordered),
+        "p50_ms": percentile(ordered, 50),
+        "p90_ms": percentile(ordered, 90),
+        "p99_ms": percentile(ordered, 99),
+        "max_ms": ordered[-1],
+    }
+
+
+def run_case(name: str, workdir: Path, repeat: int, warmup: int, resolutions) -> dict:
+    """Run one case in this process and return its result."""
+    builder, resolution = case_table(resolutions)[name]
+    with contextlib.redirect_stdout(io.StringIO()):
+        polarify, manager, wallpaper = load_polarify(workdir, resolution)
+        try:
+            run, setup, *metrics = builder(polarify, manager, wallpaper)
+        except SkipCase as e:
+            return {"name": name, "skipped": str(e)}
+
+        samples = []
+        for i in range(warmup + repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            last = run()
+            elapsed = (time.perf_counter() - start) * 1000
+            if i >= warmup:
+                samples.append(elapsed)
+
+        result = {"name": name}
+        result.update(summarize(samples))
+        result["peak_rss_kb"] = peak_rss_kb()
+        if metrics:
+            result.update(metrics[0](last))
+    return result
+
+
+def peak_rss_kb() -> int:
+    """Peak resident set size of this process in KiB.
+
+    VmHWM is reset by exec, unlike ru_maxrss which Linux carries over from
+    the parent, so it is preferred when /proc is available.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_isolated(name: str, workdir: Path, args) -> dict:
+    """Run one case in a fresh interpreter so its peak RSS is its own."""
+    command = [sys.executable, __file__, "--run-case", name, "--workdir", str(workdir),
+               "--repeat", str(args.repeat), "--warmup", str(args.warmup),
+               "--resolutions", ",".join(args.resolutions)]
+    proc = subprocess.run(command, capture_output=True, text=True, env=case_environment(workdir))
+    if proc.returncode != 0:
+        return {"name": name, "error": proc.stderr.strip().splitlines()[-1:] or ["failed"]}
+    return json.loads(proc.stdout)
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "-C", str(REPO_DIR), "rev-parse", "--short", "HEAD"],
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    versions = {}
+    for module in ("numpy", "PIL", "sklearn"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "versions": versions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark polarify hot paths")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed samples per case (default: 5)")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per case (default: 1)")
+    parser.add_argument("--resolutions", default="1080p,4k,8k",
+                        help="Comma-separated wallpaper sizes: 1080p, 4k, 8k (default: all)")
+    parser.add_argument("--only", action="append", default=[], metavar="TEXT",
+                        help="Only run cases whose name contains TEXT (repeatable)")
+    parser.add_argument("--output", "-o", help="Write JSON here instead of stdout")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary workspace")
+    parser.add_argument("--list", action="store_true", help="List case names and exit")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    args.resolutions = [name.strip().lower() for name in args.resolutions.split(",") if name.strip()]
+    unknown = [name for name in args.resolutions if name not in RESOLUTIONS]
+    if unknown:
+        parser.error(f"unknown resolution(s): {', '.join(unknown)}")
+
+    if args.run_case:
+        result = run_case(args.run_case, Path(args.workdir), args.repeat, args.warmup, args.resolutions)
+        print(json.dumps(result))
+        return
+
+    names = [name for name in case_table(args.resolutions)
+             if not args.only or any(text in name for text in args.only)]
+    if args.list:
+        print("\n".join(names))
+        return
+
+    workdir = Path(tempfile.mkdtemp(prefix="polarify-bench-"))
+    try:
+        print(f"Preparing workspace in {workdir}...", file=sys.stderr)
+        prepare_workspace(workdir, args.resolutions)
+
+        results = []
+        for name in names:
+            print(f"  {name}...", end="", flush=True, file=sys.stderr)
+            result = run_isolated(name, workdir, args)
+            if "p50_ms" in result:
+                print(f" p50 {result['p50_ms']:.1f} ms", file=sys.stderr)
+            else:
+                print(f" {result.get('skipped') or result.get('error')}", file=sys.stderr)
+            results.append(result)
+    finally:
+        if args.keep:
+            print(f"Workspace kept at {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = json.dumps({"meta": metadata(), "results": results}, indent=2)
+    if args.output:
+        Path(args.output).write_text(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
 # ~/.config/fish/completions/polarify.fish
 # polarify completions for Fish shell
 # Grammar:
-#   polarify list
+#   polarify list [--variant dark|light] [--author <text>]
 #   polarify preview <theme> [options]
 #   polarify apply <theme> [options]
+#   polarify match <image|color> [options]
+#   polarify pregen <dir> [options]
+#   polarify cache stats|clear
+#   polarify daemon
 
 complete -c polarify -f
 
@@ -51,11 +55,57 @@ function __polarify_arg_contains
     return 1
 end
 
+set -g __polarify_extractors kmeans histogram mediancut pil sklearn
+
 # --- Subcommands ------------------------------------------------------------
 complete -c polarify -n __fish_use_subcommand -a list -d "List all available themes"
 complete -c polarify -n __fish_use_subcommand -a preview -d "Preview theme colors"
 complete -c polarify -n __fish_use_subcommand -a apply -d "Apply theme"
 complete -c polarify -n __fish_use_subcommand -a watch-dark-mode -d "Watch GNOME dark mode and auto-switch themes (GNOME only)"
+complete -c polarify -n __fish_use_subcommand -a watch -d "Watch dark mode and wallpaper together and auto-apply (GNOME only)"
+complete -c polarify -n __fish_use_subcommand -a match -d "Find bundled themes closest to an image or color"
+complete -c polarify -n __fish_use_subcommand -a pregen -d "Pre-generate wallpaper themes for a folder of images"
+complete -c polarify -n __fish_use_subcommand -a audit -d "Check every theme for WCAG contrast violations"
+complete -c polarify -n __fish_use_subcommand -a cache -d "Inspect or clear the wallpaper theme and GNOME Shell CSS caches"
+
+# --- list: filters ----------------------------------------------------------
+complete -c polarify -n "__fish_seen_subcommand_from list; and not __fish_seen_argument --variant" \
+    -l variant -xa "dark light" -d "Only list dark or light themes"
+complete -c polarify -n "__fish_seen_subcommand_from list; and not __fish_seen_argument --author" \
+    -l author -x -d "Only list themes by this author"
+
+# --- watch: options ---------------------------------------------------------
+complete -c polarify -n "__fish_seen_subcommand_from watch" -l debounce -x -d "Seconds to wait for more events before applying"
+
+# --- match: image file (or hex color), then options ---------------------------
+complete -c polarify -n "__fish_seen_subcommand_from match" -F
+complete -c polarify -n "__fish_seen_subcommand_from match; and not __fish_seen_argument --variant" \
+    -l variant -xa "dark light" -d "Only consider dark or light themes"
+complete -c polarify -n "__fish_seen_subcommand_from match" -l top -x -d "Number of matches to show"
+complete -c polarify -n "__fish_seen_subcommand_from match" -l apply -d "Apply the closest theme"
+complete -c polarify -n "__fish_seen_subcommand_from match" -l extractor -xa "$__polarify_extractors" -d "Palette extractor for images"
+
+# --- pregen: directory, then options ------------------------------------------
+complete -c polarify -n "__fish_seen_subcommand_from pregen" -a "(__fish_complete_directories)"
+complete -c polarify -n "__fish_seen_subcommand_from pregen" -s j -l jobs -x -d "Worker processes"
+complete -c polarify -n "__fish_seen_subcommand_from pregen" -l extractor -xa "$__polarify_extractors" -d "Palette extractor"
+
+# --- audit: themes, then options -----------------------------------------------
+complete -c polarify -n "__fish_seen_subcommand_from audit" -a "(__theme_manager_themes)" -d "Theme name"
+complete -c polarify -n "__fish_seen_subcommand_from audit; and not __fish_seen_argument --variant" \
+    -l variant -xa "dark light" -d "Only audit dark or light themes"
+complete -c polarify -n "__fish_seen_subcommand_from audit" -l json -d "Print violations as JSON"
+complete -c polarify -n "__fish_seen_subcommand_from audit" -l fix -d "Rewrite failing colors to the nearest passing color"
+
+# --- cache: action ----------------------------------------------------------
+complete -c polarify -n "__fish_seen_subcommand_from cache; and not __fish_seen_subcommand_from stats clear" \
+    -a "stats" -d "Show cache usage"
+complete -c polarify -n "__fish_seen_subcommand_from cache; and not __fish_seen_subcommand_from stats clear" \
+    -a "clear" -d "Remove all cache entries"
+complete -c polarify -n __fish_use_subcommand -a daemon -d "Serve commands from a warm process over a Unix socket"
+complete -c polarify -n __fish_use_subcommand -l no-daemon -d "Run in this process even if a daemon is running"
+complete -c polarify -n __fish_use_subcommand -l profile-startup -d "Report import and run times when the command finishes"
+complete -c polarify -n __fish_use_subcommand -l trace -x -a "human json" -d "Print per-stage apply timings on stderr"
 
 # --- preview: theme first, then options -------------------------------------
 complete -c polarify -n "__fish_seen_subcommand_from preview; and not __polarify_seen_theme" \
@@ -73,5 +123,13 @@ complete -c polarify -n "__fish_seen_subcommand_from apply; and __polarify_seen_
 complete -c polarify -n "__fish_seen_subcommand_from apply; and __polarify_seen_theme; and not __fish_seen_argument --variant" \
     -l variant -xa "dark light" -d "Theme variant (for wallpaper)"
 
+# --extractor: only for wallpaper
+complete -c polarify -n "__fish_seen_subcommand_from apply; and __polarify_selected_theme_is wallpaper; and not __fish_seen_argument --extractor" \
+    -l extractor -xa "$__polarify_extractors" -d "Palette extractor for the wallpaper"
+
+# --live: recolor open terminals in place
+complete -c polarify -n "__fish_seen_subcommand_from apply; and __polarify_seen_theme; and not __fish_seen_argument --live" \
+    -l live -d "Recolor open terminals with OSC sequences"
+
 # --- Global help ------------------------------------------------------------
 complete -c polarify -s h -l help -d "Show help message"
@@ -0,0 +1,13 @@
+# --- Polarify live recolor ---
+# Register this shell's terminal so `polarify apply --live` can recolor it in place
+if status is-interactive; and set -q XDG_RUNTIME_DIR
+    set -l tty (tty 2>/dev/null)
+    if test $status -eq 0
+        command mkdir -p $XDG_RUNTIME_DIR/polarify-ttys
+        echo $tty >$XDG_RUNTIME_DIR/polarify-ttys/$fish_pid
+
+        function __polarify_unregister_tty --on-event fish_exit
+            command rm -f $XDG_RUNTIME_DIR/polarify-ttys/$fish_pid
+        end
+    end
+end
@@ -23,36 +23,713 @@ Integrates with GNOME settings for dark mode and wallpaper changes.
 # To undo skip work tree:
 # git update-index --no-skip-worktree
 
+import time
+_STARTED = time.perf_counter()
+
 import json
 import sys
-import time
 import hashlib
 import subprocess
 import shutil
 import re
 import os
+import mmap
+import select
+import struct
+import urllib.parse
 from pathlib import Path
 from typing import Dict, Any, List, Tuple, Optional
-from collections import Counter
 import argparse
+import atexit
+import contextlib
+import copy
+import functools
+import io
+import socket
+import stat
+import tempfile
+import threading
+import importlib
+import importlib.util
+
+
+class _LazyModule:
+    """Module proxy that imports on first attribute access.
+    
+    numpy, PIL and gi together cost hundreds of milliseconds to import, while
+    list/preview need none of them. Load times are recorded in `loaded` for
+    --profile-startup.
+    """
+    
+    loaded: Dict[str, float] = {}
+    
+    def __init__(self, name: str):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+    
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self._name)
+            _LazyModule.loaded[self._name] = time.perf_counter() - start
+            self.__dict__['_module'] = module
+        return module
+    
+    def __getattr__(self, attr):
+        # Keep resolved attributes on the proxy so later lookups skip this hook
+        value = getattr(self._load(), attr)
+        self.__dict__[attr] = value
+        return value
+    
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+
+def _available(*names: str) -> bool:
+    """Whether all top-level packages can be imported, without importing them."""
+    return all(importlib.util.find_spec(name) is not None for name in names)
+
+
+np = _LazyModule('numpy')
+Image = _LazyModule('PIL.Image')
+IMAGING_AVAILABLE = _available('numpy', 'PIL')
+
+Gio = _LazyModule('gi.repository.Gio')
+GLib = _LazyModule('gi.repository.GLib')
+GNOME_AVAILABLE = _available('gi')
+
+_IMPORTED = time.perf_counter()
+
+
+def cache_dir() -> Path:
+    """Directory for polarify's caches ($XDG_CACHE_HOME/polarify)."""
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / ".cache"
+    return Path(base) / "polarify"
+
+
+def uri_to_path(uri: str) -> str:
+    """Turn a (possibly quoted, percent-encoded) file:// URI or plain path into a path."""
+    uri = uri.strip()
+    if len(uri) >= 2 and uri[0] == uri[-1] == "'":
+        uri = uri[1:-1]
+    if uri.startswith('file://'):
+        return urllib.parse.unquote(urllib.parse.urlparse(uri).path)
+    return uri
+
+
+def file_digest(path, chunk_size: int = 1 << 20) -> str:
+    """Hash a file's contents with blake2b, streaming it in chunks."""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """Small on-disk key/value store with least-recently-used eviction.
+    
+    Every entry is one file named after its key. Reading an entry bumps its
+    mtime, so the oldest mtimes are evicted first once the cache grows past
+    max_entries or max_bytes.
+    """
+    
+    def __init__(self, root: Path, max_entries: int = 64, max_bytes: int = 64 * 1024 * 1024):
+        self.root = Path(root)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+    
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Build a stable cache key from JSON-serializable parts."""
+        payload = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+        return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+    
+    def _entries(self) -> List[Path]:
+        if not self.root.is_dir():
+            return []
+        return [p for p in self.root.iterdir() if p.is_file() and not p.name.startswith('.')]
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the JSON entry stored under key, or None."""
+        entry = self.root / f"{key}.json"
+        try:
+            with open(entry, 'r') as f:
+                value = json.load(f)
+            os.utime(entry)
+            return value
+        except (OSError, ValueError):
+            return None
+    
+    def put(self, key: str, value: Dict[str, Any]):
+        """Store a JSON entry under key, evicting old entries if needed."""
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.root / f".{key}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(value, f)
+            os.replace(tmp, self.root / f"{key}.json")
+            self.evict()
+        except OSError as e:
+            print(f"  ⚠ Could not write cache entry: {e}")
+    
+    def get_file(self, key: str, suffix: str) -> Optional[Path]:
+        """Return the path of a file entry, or None."""
+        entry = self.root / f"{key}{suffix}"
+        try:
+            os.utime(entry)
+            return entry
+        except OSError:
+            return None
+    
+    def put_file(self, key: str, source: Path, suffix: str) -> Optional[Path]:
+        """Copy a file into the cache under key and return its cached path."""
+        entry = self.root / f"{key}{suffix}"
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.root / f".{key}.tmp"
+            shutil.copyfile(source, tmp)
+            os.replace(tmp, entry)
+            self.evict()
+            return entry
+        except OSError as e:
+            print(f"  ⚠ Could not write cache entry: {e}")
+            return None
+    
+    def evict(self):
+        """Drop least recently used entries until the size limits hold."""
+        entries = []
+        for path in self._entries():
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort(key=lambda e: e[0], reverse=True)
+        
+        total = 0
+        for i, (_, size, path) in enumerate(entries):
+            total += size
+            if i >= self.max_entries or total > self.max_bytes:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+    
+    def stats(self) -> Dict[str, Any]:
+        """Return entry count and total size."""
+        sizes = []
+        for path in self._entries():
+            try:
+                sizes.append(path.stat().st_size)
+            except OSError:
+                pass
+        return {"path": str(self.root), "entries": len(sizes), "bytes": sum(sizes),
+                "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+    
+    def clear(self) -> int:
+        """Remove every entry and return how many were removed."""
+        removed = 0
+        for path in self._entries():
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+
+class FileChangeDetector:
+    """Content hashes of files, recomputed only when (size, mtime, inode) changes."""
+    
+    def __init__(self):
+        self._known: Dict[str, Tuple[Tuple[int, int, int], str]] = {}
+    
+    @staticmethod
+    def signature(path) -> Optional[Tuple[str, int, int, int]]:
+        """Cheap stand-in for the content: path, size, mtime and inode (None if missing).
+        
+        Event callbacks compare this instead of hashing, which would block the
+        main loop on a large wallpaper; the worker hashes when it applies.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (str(path), st.st_size, st.st_mtime_ns, st.st_ino)
+    
+    def digest(self, path) -> Optional[str]:
+        """Return the file's blake2b digest, or None if it cannot be read."""
+        path = str(path)
+        try:
+            st = os.stat(path)
+            signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+            known = self._known.get(path)
+            if known and known[0] == signature:
+                return known[1]
+            value = file_digest(path)
+        except OSError:
+            return None
+        self._known[path] = (signature, value)
+        return value
+
+
+class InotifyWatcher:
+    """Minimal inotify wrapper (via ctypes) reporting paths that were written or replaced."""
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_HEADER = struct.Struct('iIII')
+    
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._watches: Dict[int, Path] = {}
+    
+    def add(self, directory: Path):
+        """Watch a directory for files being closed after writing, created or moved in."""
+        directory = Path(directory)
+        if directory in self._watches.values():
+            return
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), mask)
+        if wd < 0:
+            raise OSError(f"Cannot watch {directory}")
+        self._watches[wd] = directory
+    
+    def read(self, timeout: float = None) -> set:
+        """Block up to timeout seconds and return the set of paths that changed."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        
+        paths = set()
+        offset = 0
+        while offset + self.EVENT_HEADER.size <= len(data):
+            wd, _, _, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if wd in self._watches and name:
+                paths.add(self._watches[wd] / os.fsdecode(name))
+        return paths
+    
+    def close(self):
+        os.close(self.fd)
+
+
+class Tracer:
+    """Nested timing spans around the stages of an apply.
+    
+    Nothing is recorded unless a format is configured (--trace). When a root
+    span ends, its tree is written to stderr as indented text or JSON lines;
+    if stderr is the journal stream set up by systemd, spans are sent to
+    journald as structured POLARIFY_* fields instead.
+    """
+    
+    FORMATS = ('human', 'json')
+    JOURNAL_SOCKET = "/run/systemd/journal/socket"
+    
+    def __init__(self):
+        self.format: Optional[str] = None
+        self.journal = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._finished: List[Dict[str, Any]] = []
+    
+    def configure(self, fmt: Optional[str]):
+        self.format = fmt
+        self.journal = bool(fmt) and self.stderr_is_journal()
+    
+    @staticmethod
+    def stderr_is_journal() -> bool:
+        """Whether stderr is the journal stream systemd advertised in JOURNAL_STREAM."""
+        stream = os.environ.get('JOURNAL_STREAM', '')
+        try:
+            device, inode = (int(part) for part in stream.split(':'))
+            st = os.fstat(sys.stderr.fileno())
+        except (ValueError, OSError, AttributeError):
+            return False
+        return (st.st_dev, st.st_ino) == (device, inode)
+    
+    def _stack(self) -> List[Dict[str, Any]]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+    
+    def current(self) -> Optional[Dict[str, Any]]:
+        """The innermost open span on this thread, to parent work handed to other threads."""
+        stack = self._stack()
+        return stack[-1] if stack else None
+    
+    def annotate(self, **fields):
+        """Attach fields to the innermost open span."""
+        span = self.current()
+        if span is not None:
+            span["fields"].update(fields)
+    
+    @contextlib.contextmanager
+    def span(self, name: str, parent: Optional[Dict[str, Any]] = None, **fields):
+        """Time the enclosed block as a child of the current (or given) span."""
+        if not self.format:
+            yield
+            return
+        
+        stack = self._stack()
+        parent = parent if parent is not None else (stack[-1] if stack else None)
+        record = {"name": name, "parent": parent, "fields": fields,
+                  "path": f"{parent['path']}/{name}" if parent else name,
+                  "depth": parent["depth"] + 1 if parent else 0}
+        stack.append(record)
+        record["start"] = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            fields["error"] = type(e).__name__
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - record["start"]
+            stack.pop()
+            with self._lock:
+                self._finished.append(record)
+            if parent is None:
+                self.flush(record)
+    
+    def traced(self, name: str):
+        """Decorator running a function inside a span."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+    
+    def flush(self, root: Dict[str, Any]):
+        """Emit every finished span under root depth-first, siblings in start order."""
+        def under_root(record):
+            while record is not None:
+                if record is root:
+                    return True
+                record = record["parent"]
+            return False
+        
+        with self._lock:
+            finished = [record for record in self._finished if under_root(record)]
+            self._finished = [record for record in self._finished if not under_root(record)]
+        
+        children: Dict[int, List[Dict[str, Any]]] = {}
+        for record in sorted(finished, key=lambda record: record["start"]):
+            if record["parent"] is not None:
+                children.setdefault(id(record["parent"]), []).append(record)
+        spans, todo = [], [root]
+        while todo:
+            record = todo.pop()
+            spans.append(record)
+            todo.extend(reversed(children.get(id(record), [])))
+        
+        if self.journal:
+            self.send_journal(root, spans)
+            return
+        for record in spans:
+            ms = record["seconds"] * 1000
+            if self.format == 'json':
+                entry = {"span": record["path"], "depth": record["depth"],
+                         "start_ms": round((record["start"] - root["start"]) * 1000, 3),
+                         "duration_ms": round(ms, 3)}
+                entry.update(record["fields"])
+                print(json.dumps(entry, default=str), file=sys.stderr)
+            else:
+                label = "  " * record["depth"] + record["name"]
+                extra = " ".join(f"{key}={value}" for key, value in record["fields"].items())
+                print(f"⏱ {label:<34} {ms:9.1f} ms  {extra}".rstrip(), file=sys.stderr)
+    
+    def send_journal(self, root: Dict[str, Any], spans: List[Dict[str, Any]]):
+        """Send one journald entry per span over the native protocol."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            for record in spans:
+                ms = record["seconds"] * 1000
+                fields = {
+                    "MESSAGE": f"{record['path']} {ms:.1f} ms",
+                    "PRIORITY": 7,
+                    "SYSLOG_IDENTIFIER": "polarify",
+                    "POLARIFY_SPAN": record["path"],
+                    "POLARIFY_DURATION_MS": f"{ms:.3f}",
+                    "POLARIFY_START_MS": f"{(record['start'] - root['start']) * 1000:.3f}",
+                }
+                for key, value in record["fields"].items():
+                    fields[f"POLARIFY_{re.sub(r'[^A-Z0-9_]', '_', key.upper())}"] = value
+                payload = "".join(f"{key}={value}\n" for key, value in fields.items()
+                                  if "\n" not in str(value))
+                sock.sendto(payload.encode(), self.JOURNAL_SOCKET)
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+
+tracer = Tracer()
+
+
+class ColorSpace:
+    """Vectorized sRGB <-> linear <-> OKLab/OKLCH conversions.
+    
+    8-bit sRGB values are linearized through a 256-entry lookup table instead
+    of evaluating the transfer curve per channel. Every function works on
+    (..., 3) arrays; sRGB values are floats in 0..255.
+    """
+    
+    _LINEAR_LUT = None
+    
+    # Linear sRGB -> LMS and cube-root LMS -> OKLab (Björn Ottosson), as row-vector matrices
+    LMS = [[0.4122214708, 0.2119034982, 0.0883024619],
+           [0.5363325363, 0.6806995451, 0.2817188376],
+           [0.0514459929, 0.1073969566, 0.6299787005]]
+    LAB = [[0.2104542553, 1.9779984951, 0.0259040371],
+           [0.7936177850, -2.4285922050, 0.7827717662],
+           [-0.0040720468, 0.4505937099, -0.8086757660]]
+    LAB_INV = [[1.0, 1.0, 1.0],
+               [0.3963377774, -0.1055613458, -0.0894841775],
+               [0.2158037573, -0.0638541728, -1.2914855480]]
+    LMS_INV = [[4.0767416621, -1.2684380046, -0.0041960863],
+               [-3.3077115913, 2.6097574011, -0.7034186147],
+               [0.2309699292, -0.3413193965, 1.7076147010]]
+    
+    @classmethod
+    def linear_lut(cls) -> "np.ndarray":
+        """Linear-light value of each 8-bit sRGB level."""
+        if cls._LINEAR_LUT is None:
+            c = np.arange(256, dtype=np.float64) / 255.0
+            cls._LINEAR_LUT = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+        return cls._LINEAR_LUT
+    
+    @classmethod
+    def srgb_to_linear(cls, rgb: "np.ndarray") -> "np.ndarray":
+        """Linearize sRGB (0..255); whole-number inputs use the lookup table."""
+        rgb = np.asarray(rgb, dtype=np.float64)
+        levels = np.clip(np.rint(rgb), 0, 255)
+        if np.array_equal(levels, rgb):
+            return cls.linear_lut()[levels.astype(np.intp)]
+        c = np.clip(rgb, 0, 255) / 255.0
+        return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    
+    @staticmethod
+    def linear_to_srgb(linear: "np.ndarray") -> "np.ndarray":
+        """Encode linear light as sRGB floats in 0..255 (out-of-gamut values are clipped)."""
+        c = np.clip(linear, 0.0, 1.0)
+        return 255.0 * np.where(c <= 0.0031308, c * 12.92, 1.055 * c ** (1 / 2.4) - 0.055)
+    
+    @classmethod
+    def srgb_to_oklab(cls, rgb: "np.ndarray") -> "np.ndarray":
+        """sRGB (0..255) to OKLab with L in 0..1."""
+        return np.cbrt(cls.srgb_to_linear(rgb) @ np.array(cls.LMS)) @ np.array(cls.LAB)
+    
+    @classmethod
+    def oklab_to_linear(cls, lab: "np.ndarray") -> "np.ndarray":
+        """OKLab to linear sRGB, unclipped (out-of-gamut colors fall outside 0..1)."""
+        lms = (np.asarray(lab, dtype=np.float64) @ np.array(cls.LAB_INV)) ** 3
+        return lms @ np.array(cls.LMS_INV)
+    
+    @classmethod
+    def oklab_to_srgb(cls, lab: "np.ndarray") -> "np.ndarray":
+        """OKLab to sRGB floats in 0..255, clipped to the sRGB gamut."""
+        return cls.linear_to_srgb(cls.oklab_to_linear(lab))
+    
+    @classmethod
+    def gamut_map(cls, lab: "np.ndarray", iterations: int = 16) -> "np.ndarray":
+        """Bring (N, 3) OKLab colors into the sRGB gamut by reducing chroma.
+        
+        Lightness and hue are kept; clipping channels instead would shift both.
+        Out-of-gamut rows bisect their chroma scale, since grays are always inside.
+        """
+        lab = np.array(lab, dtype=np.float64).reshape(-1, 3)
+        lab[:, 0] = np.clip(lab[:, 0], 0.0, 1.0)
+        
+        def inside(candidate):
+            linear = cls.oklab_to_linear(candidate)
+            return ((linear >= -1e-6) & (linear <= 1 + 1e-6)).all(axis=1)
+        
+        out = ~inside(lab)
+        if out.any():
+            colors = lab[out]
+            lo = np.zeros(len(colors))
+            hi = np.ones(len(colors))
+            for _ in range(iterations):
+                mid = (lo + hi) / 2
+                ok = inside(np.column_stack([colors[:, :1], colors[:, 1:] * mid[:, None]]))
+                lo = np.where(ok, mid, lo)
+                hi = np.where(ok, hi, mid)
+            lab[out, 1:] *= lo[:, None]
+        return lab
+    
+    @staticmethod
+    def oklab_to_oklch(lab: "np.ndarray") -> "np.ndarray":
+        """OKLab to OKLCH (lightness, chroma, hue in radians)."""
+        lab = np.asarray(lab, dtype=np.float64)
+        return np.stack([lab[..., 0], np.hypot(lab[..., 1], lab[..., 2]),
+                         np.arctan2(lab[..., 2], lab[..., 1])], axis=-1)
+    
+    @staticmethod
+    def oklch_to_oklab(lch: "np.ndarray") -> "np.ndarray":
+        """OKLCH back to OKLab."""
+        lch = np.asarray(lch, dtype=np.float64)
+        return np.stack([lch[..., 0], lch[..., 1] * np.cos(lch[..., 2]),
+                         lch[..., 1] * np.sin(lch[..., 2])], axis=-1)
+
+
+class ColorEngine:
+    """Batched color math on (N, 3) arrays of 8-bit RGB values."""
+
+    # WCAG relative luminance weights of linear R, G, B
+    LUMA = (0.2126, 0.7152, 0.0722)
+
+    @staticmethod
+    def to_array(colors) -> "np.ndarray":
+        """Convert hex strings or RGB tuples into an (N, 3) float array."""
+        if isinstance(colors, np.ndarray):
+            return colors.reshape(-1, 3).astype(np.float64)
+        if isinstance(colors, str):
+            colors = [colors]
+        rows = []
+        for color in colors:
+            if isinstance(color, str):
+                value = int(color.lstrip('#')[:6], 16)
+                rows.append(((value >> 16) & 0xFF, (value >> 8) & 0xFF, value & 0xFF))
+            else:
+                rows.append(tuple(color))
+        return np.array(rows, dtype=np.float64).reshape(-1, 3)
+
+    @staticmethod
+    def to_hex(rgb: "np.ndarray") -> List[str]:
+        """Convert an (N, 3) array into a list of hex strings."""
+        rgb = np.clip(rgb, 0, 255).astype(np.int64).reshape(-1, 3)
+        codes = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+        return [f"#{code:06x}" for code in codes.tolist()]
+
+    @classmethod
+    def luminance(cls, rgb: "np.ndarray") -> "np.ndarray":
+        """Relative luminance (WCAG) of every row."""
+        return ColorSpace.srgb_to_linear(rgb) @ np.array(cls.LUMA)
+
+    @staticmethod
+    def contrast_from_luminance(lum1: "np.ndarray", lum2: "np.ndarray") -> "np.ndarray":
+        """Contrast ratio between two broadcastable luminance arrays."""
+        lighter = np.maximum(lum1, lum2)
+        darker = np.minimum(lum1, lum2)
+        return (lighter + 0.05) / (darker + 0.05)
+
+    @classmethod
+    def contrast(cls, rgb1: "np.ndarray", rgb2: "np.ndarray") -> "np.ndarray":
+        """Pairwise contrast ratio between matching rows of two arrays."""
+        return cls.contrast_from_luminance(cls.luminance(rgb1), cls.luminance(rgb2))
+
+    @classmethod
+    def contrast_matrix(cls, rgb1: "np.ndarray", rgb2: "np.ndarray") -> "np.ndarray":
+        """Contrast ratio of every row of rgb1 against every row of rgb2, shape (N, M)."""
+        return cls.contrast_from_luminance(cls.luminance(rgb1)[:, None],
+                                           cls.luminance(rgb2)[None, :])
+
+    @staticmethod
+    def scale_brightness(rgb: "np.ndarray", factors) -> "np.ndarray":
+        """Scale each row's OKLab lightness by a per-row (or scalar) factor, keeping hue.
+        
+        Chroma is kept too unless the result leaves the sRGB gamut, in which
+        case it is reduced just enough to fit.
+        """
+        factors = np.asarray(factors, dtype=np.float64).reshape(-1, 1)
+        lab = ColorSpace.srgb_to_oklab(np.asarray(rgb, dtype=np.float64).reshape(-1, 3))
+        lab[:, :1] = lab[:, :1] * factors
+        return np.round(ColorSpace.oklab_to_srgb(ColorSpace.gamut_map(lab)))
+
+    @staticmethod
+    def scale_saturation(rgb: "np.ndarray", factors) -> "np.ndarray":
+        """Scale each row's OKLCH chroma by a per-row (or scalar) factor, keeping lightness and hue."""
+        factors = np.asarray(factors, dtype=np.float64).reshape(-1)
+        lch = ColorSpace.oklab_to_oklch(
+            ColorSpace.srgb_to_oklab(np.asarray(rgb, dtype=np.float64).reshape(-1, 3)))
+        lch[:, 1] *= np.maximum(factors, 0.0)
+        return np.round(ColorSpace.oklab_to_srgb(ColorSpace.gamut_map(ColorSpace.oklch_to_oklab(lch))))
+
+    @classmethod
+    def solve_contrast(cls, fg: "np.ndarray", bg: "np.ndarray", ratios) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Find the smallest change to each fg row that reaches the WCAG ratio against bg.
+
+        Colors are scaled in linear light, which scales OKLab L, a and b alike
+        (hue and saturation are kept exactly) and luminance proportionally, so
+        the scale that lands on the target luminance is solved directly. When
+        lightening runs out of gamut first, the scaled color is mixed with white
+        in linear light, which is linear in luminance too. When both directions
+        can reach the ratio, fg moves away from bg on the side it is already on;
+        otherwise it goes toward whichever extreme gives more contrast.
+
+        Returns the adjusted (N, 3) array and a boolean mask of rows that reached
+        their target; unreachable rows are pushed to black or white.
+        """
+        fg = np.asarray(fg, dtype=np.float64).reshape(-1, 3)
+        bg = np.broadcast_to(np.asarray(bg, dtype=np.float64).reshape(-1, 3), fg.shape)
+        ratios = np.broadcast_to(np.asarray(ratios, dtype=np.float64).reshape(-1), fg.shape[:1])
 
-try:
-    from PIL import Image
-    import numpy as np
-    IMAGING_AVAILABLE = True
-except ImportError:
-    IMAGING_AVAILABLE = False
+        linear = ColorSpace.srgb_to_linear(fg)
+        lum = linear @ np.array(cls.LUMA)
+        bg_lum = cls.luminance(bg)
+        up = ratios * (bg_lum + 0.05) - 0.05
+        down = (bg_lum + 0.05) / ratios - 0.05
+        lighten = np.where((up <= 1.0) & (down >= 0.0), lum >= bg_lum,
+                           1.05 / (bg_lum + 0.05) >= (bg_lum + 0.05) / 0.05)
+        target = np.where(lighten, up, down)
+        sign = np.where(lighten, 1.0, -1.0)
+        reachable = np.where(lighten, target <= 1.0, target >= 0.0)
 
-try:
-    from gi.repository import Gio, GLib
-    GNOME_AVAILABLE = True
-except ImportError:
-    GNOME_AVAILABLE = False
+        def meets(lum):
+            return sign * (lum - target) >= 0
+
+        done = (cls.contrast_from_luminance(lum, bg_lum) >= ratios) | meets(lum)
+        unreachable = ~done & ~reachable
+        solve = ~done & reachable
+        result = fg.copy()
+        result[unreachable] = np.where(lighten, 255.0, 0.0)[unreachable, None]
+        if not solve.any():
+            return result, ~unreachable
+
+        # Lightening stops scaling where the brightest channel reaches 1
+        goal = np.clip(target, 0.0, 1.0)
+        scale = goal / np.maximum(lum, 1e-12)
+        scale = np.where(lighten, np.minimum(scale, 1.0 / np.maximum(linear.max(axis=1), 1e-12)), scale)
+        scaled = linear * scale[:, None]
+        scaled_lum = scaled @ np.array(cls.LUMA)
+        mix = np.where(lighten & (scaled_lum < goal),
+                       (goal - scaled_lum) / np.maximum(1.0 - scaled_lum, 1e-12), 0.0)
+        solved = np.round(ColorSpace.linear_to_srgb(scaled + (1.0 - scaled) * mix[:, None]))
+
+        # Rounding to 8 bits can land just short; one level further always passes
+        short = solve & ~meets(cls.luminance(solved))
+        solved[short] = np.clip(solved[short] + sign[short, None], 0, 255)
+        result[solve] = solved[solve]
+        return result, ~unreachable
 
 
 class ImageThemeGenerator:
     """Generate theme colors from an image."""
     
+    # Fewer colors than this are padded with shades before building a theme
+    MIN_COLORS = 6
+    
     @staticmethod
     def hex_to_rgb(hex_color: str) -> Tuple[int, int, int]:
         """Convert hex color to RGB tuple."""
@@ -62,151 +739,307 @@ class ImageThemeGenerator:
     @staticmethod
     def rgb_to_hex(rgb: Tuple[int, int, int]) -> str:
         """Convert RGB tuple to hex color."""
-        return f"#{rgb[0]:02x}{rgb[1]:02x}{rgb[2]:02x}"
+        return f"#{int(rgb[0]):02x}{int(rgb[1]):02x}{int(rgb[2]):02x}"
     
     @staticmethod
     def get_luminance(rgb: Tuple[int, int, int]) -> float:
         """Calculate relative luminance of a color."""
-        r, g, b = [x / 255.0 for x in rgb]
-        r = r / 12.92 if r <= 0.03928 else ((r + 0.055) / 1.055) ** 2.4
-        g = g / 12.92 if g <= 0.03928 else ((g + 0.055) / 1.055) ** 2.4
-        b = b / 12.92 if b <= 0.03928 else ((b + 0.055) / 1.055) ** 2.4
-        return 0.2126 * r + 0.7152 * g + 0.0722 * b
+        return float(ColorEngine.luminance(ColorEngine.to_array([rgb]))[0])
     
     @staticmethod
     def get_contrast_ratio(color1: str, color2: str) -> float:
         """Calculate contrast ratio between two colors."""
-        lum1 = ImageThemeGenerator.get_luminance(ImageThemeGenerator.hex_to_rgb(color1))
-        lum2 = ImageThemeGenerator.get_luminance(ImageThemeGenerator.hex_to_rgb(color2))
-        lighter = max(lum1, lum2)
-        darker = min(lum1, lum2)
-        return (lighter + 0.05) / (darker + 0.05)
+        rgb = ColorEngine.to_array([color1, color2])
+        return float(ColorEngine.contrast(rgb[:1], rgb[1:])[0])
     
     @staticmethod
     def adjust_brightness(rgb: Tuple[int, int, int], factor: float) -> Tuple[int, int, int]:
         """Adjust brightness of RGB color."""
-        return tuple(max(0, min(255, int(c * factor))) for c in rgb)
+        adjusted = ColorEngine.scale_brightness(ColorEngine.to_array([rgb]), factor)
+        return tuple(int(c) for c in adjusted[0])
     
     @staticmethod
     def adjust_saturation(rgb: Tuple[int, int, int], factor: float) -> Tuple[int, int, int]:
         """Adjust saturation of RGB color."""
-        r, g, b = rgb
-        gray = int(0.299 * r + 0.587 * g + 0.114 * b)
-        r = int(gray + (r - gray) * factor)
-        g = int(gray + (g - gray) * factor)
-        b = int(gray + (b - gray) * factor)
-        return (max(0, min(255, r)), max(0, min(255, g)), max(0, min(255, b)))
+        adjusted = ColorEngine.scale_saturation(ColorEngine.to_array([rgb]), factor)
+        return tuple(int(c) for c in adjusted[0])
     
     @staticmethod
-    def extract_dominant_colors(image_path: str, n_colors: int = 12) -> List[str]:
-        """Extract dominant colors from an image."""
-        try:
-            from sklearn.cluster import KMeans
-            use_kmeans = True
-        except ImportError:
-            use_kmeans = False
-        
-        img = Image.open(image_path).convert('RGB').resize((150, 150))
-        pixels = np.array(img).reshape(-1, 3)[::10]  # Sample every 10th pixel
-        
-        if use_kmeans:
-            kmeans = KMeans(n_clusters=n_colors, random_state=42, n_init=10)
-            kmeans.fit(pixels)
-            colors = [tuple(c) for c in kmeans.cluster_centers_.astype(int)]
-            labels = kmeans.labels_
-            counts = Counter(labels)
-            sorted_colors = [colors[i] for i, _ in counts.most_common()]
-        else:
-            # Fallback: simple quantization
-            step = 32
-            quantized = [((r // step) * step, (g // step) * step, (b // step) * step) 
-                        for r, g, b in pixels]
-            
-            color_counts = Counter(quantized)
-            dominant = [color for color, _ in color_counts.most_common(n_colors * 2)]
-            
-            sorted_colors = [dominant[0]]
-            for color in dominant[1:]:
-                if len(sorted_colors) >= n_colors:
-                    break
-                if all(sum(abs(int(c1) - int(c2)) for c1, c2 in zip(color, s)) > 60 for s in sorted_colors):
-                    sorted_colors.append(color)
-        
-        return [ImageThemeGenerator.rgb_to_hex(c) for c in sorted_colors]
+    def color_histogram(pixels: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+        """Bucket pixels into a 15-bit color histogram.
+
+        Returns the mean color of every occupied bucket and its pixel count.
+        """
+        pixels = pixels.reshape(-1, 3).astype(np.int64)
+        codes = ((pixels[:, 0] >> 3) << 10) | ((pixels[:, 1] >> 3) << 5) | (pixels[:, 2] >> 3)
+        counts = np.bincount(codes, minlength=1 << 15)
+        occupied = np.nonzero(counts)[0]
+        sums = np.stack([np.bincount(codes, weights=pixels[:, i], minlength=1 << 15)[occupied]
+                         for i in range(3)], axis=1)
+        weights = counts[occupied].astype(np.float64)
+        return sums / weights[:, None], weights
     
     @staticmethod
-    def ensure_contrast(fg_color: str, bg_color: str, min_ratio: float = 4.5) -> str:
-        """Ensure foreground color has sufficient contrast with background."""
-        ratio = ImageThemeGenerator.get_contrast_ratio(fg_color, bg_color)
-        if ratio >= min_ratio:
-            return fg_color
+    def kmeans_palette(pixels: "np.ndarray", n_colors: int = 12, max_iter: int = 20,
+                       time_budget: float = 0.25, tol: float = 0.002) -> List[Tuple[str, float]]:
+        """Weighted k-means over the color histogram in OKLab, seeded deterministically.
+
+        Clustering in OKLab makes distances perceptual. Seeds use greedy
+        k-means++: the most populated bucket first, then the bucket with the
+        largest population-weighted squared distance to the chosen seeds.
+        Lloyd iterations stop on convergence, after max_iter rounds or once
+        time_budget seconds have elapsed.
+        """
+        points, weights = ImageThemeGenerator.color_histogram(pixels)
+        points = ColorSpace.srgb_to_oklab(points)
+        k = min(n_colors, len(points))
+        
+        centers = np.empty((k, 3))
+        centers[0] = points[np.argmax(weights)]
+        d2 = ((points - centers[0]) ** 2).sum(axis=1)
+        for i in range(1, k):
+            centers[i] = points[np.argmax(weights * d2)]
+            d2 = np.minimum(d2, ((points - centers[i]) ** 2).sum(axis=1))
+        
+        deadline = time.monotonic() + time_budget
+        for _ in range(max_iter):
+            distances = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+            labels = distances.argmin(axis=1)
+            population = np.bincount(labels, weights=weights, minlength=k)
+            sums = np.stack([np.bincount(labels, weights=weights * points[:, i], minlength=k)
+                             for i in range(3)], axis=1)
+            filled = population > 0
+            updated = centers.copy()
+            updated[filled] = sums[filled] / population[filled, None]
+            shift = np.abs(updated - centers).max()
+            centers = updated
+            if shift < tol or time.monotonic() > deadline:
+                break
+        
+        population = np.bincount(ImageThemeGenerator.nearest(points, centers), weights=weights, minlength=k)
+        return ImageThemeGenerator.rank_palette(np.round(ColorSpace.oklab_to_srgb(centers)), population)
+    
+    @staticmethod
+    def nearest(points: "np.ndarray", centers: "np.ndarray") -> "np.ndarray":
+        """Index of the closest center for every point."""
+        return ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    
+    @staticmethod
+    def rank_palette(colors: "np.ndarray", population: "np.ndarray") -> List[Tuple[str, float]]:
+        """Pair sRGB colors with their population share, most common first, dropping empty ones."""
+        order = [i for i in np.argsort(-population, kind="stable") if population[i] > 0]
+        hex_colors = ColorEngine.to_hex(colors[order])
+        return list(zip(hex_colors, (population[order] / population.sum()).tolist()))
+    
+    @staticmethod
+    def histogram_palette(pixels: "np.ndarray", n_colors: int = 12,
+                          min_distance: float = 0.08) -> List[Tuple[str, float]]:
+        """Most populated histogram buckets that are perceptually distinct.
         
-        fg_rgb = ImageThemeGenerator.hex_to_rgb(fg_color)
-        bg_lum = ImageThemeGenerator.get_luminance(ImageThemeGenerator.hex_to_rgb(bg_color))
+        Picks the heaviest 15-bit bucket, masks every bucket within min_distance
+        (OKLab) of it, and repeats; the distance is halved if the image runs
+        out of distinct colors. Colors are real bucket means, not averages.
+        """
+        points, weights = ImageThemeGenerator.color_histogram(pixels)
+        lab = ColorSpace.srgb_to_oklab(points)
+        k = min(n_colors, len(points))
+        
+        chosen: List[int] = []
+        for threshold in (min_distance, min_distance / 2, min_distance / 4, 0.0):
+            available = np.ones(len(lab), dtype=bool)
+            for i in chosen:
+                available &= ((lab - lab[i]) ** 2).sum(axis=1) > threshold ** 2
+            while len(chosen) < k and available.any():
+                candidates = np.flatnonzero(available)
+                i = candidates[np.argmax(weights[candidates])]
+                chosen.append(i)
+                available &= ((lab - lab[i]) ** 2).sum(axis=1) > threshold ** 2
+            if len(chosen) == k:
+                break
+        
+        population = np.bincount(ImageThemeGenerator.nearest(lab, lab[chosen]),
+                                 weights=weights, minlength=len(chosen))
+        return ImageThemeGenerator.rank_palette(np.round(points[chosen]), population)
+    
+    @staticmethod
+    def mediancut_palette(pixels: "np.ndarray", n_colors: int = 12) -> List[Tuple[str, float]]:
+        """Median cut over the color histogram in OKLab.
         
-        if bg_lum > 0.5:
-            factor = 0.7
-            step = -0.05
-            min_factor = 0.1
-        else:
-            factor = 1.3
-            step = 0.1
-            min_factor = 3.0
+        Repeatedly splits the box with the largest population-weighted extent
+        at the weighted median of its longest axis; each box becomes its
+        weighted mean color.
+        """
+        points, weights = ImageThemeGenerator.color_histogram(pixels)
+        lab = ColorSpace.srgb_to_oklab(points)
+        boxes = [np.arange(len(lab))]
+        
+        while len(boxes) < n_colors:
+            best, best_score, best_axis = None, 0.0, 0
+            for j, members in enumerate(boxes):
+                if len(members) < 2:
+                    continue
+                extent = lab[members].max(axis=0) - lab[members].min(axis=0)
+                axis = int(np.argmax(extent))
+                score = extent[axis] * weights[members].sum()
+                if score > best_score:
+                    best, best_score, best_axis = j, score, axis
+            if best is None:
+                break
+            
+            members = boxes.pop(best)
+            order = np.argsort(lab[members, best_axis], kind="stable")
+            cumulative = np.cumsum(weights[members][order])
+            cut = int(np.clip(np.searchsorted(cumulative, cumulative[-1] / 2), 1, len(members) - 1))
+            boxes += [members[order[:cut]], members[order[cut:]]]
+        
+        population = np.array([weights[members].sum() for members in boxes])
+        centers = np.stack([np.average(lab[members], axis=0, weights=weights[members])
+                            for members in boxes])
+        return ImageThemeGenerator.rank_palette(np.round(ColorSpace.oklab_to_srgb(centers)), population)
+    
+    @staticmethod
+    def pil_palette(pixels: "np.ndarray", n_colors: int = 12) -> List[Tuple[str, float]]:
+        """Pillow's built-in fast octree quantizer."""
+        quantize = getattr(Image, "Quantize", Image)
+        img = Image.fromarray(np.ascontiguousarray(pixels.reshape(1, -1, 3), dtype=np.uint8))
+        quantized = img.quantize(colors=n_colors, method=quantize.FASTOCTREE)
+        indices = np.asarray(quantized).ravel()
+        palette = np.array(quantized.getpalette(), dtype=np.float64).reshape(-1, 3)
+        population = np.bincount(indices, minlength=len(palette))[:len(palette)]
+        return ImageThemeGenerator.rank_palette(palette, population)
+    
+    @staticmethod
+    def sklearn_palette(pixels: "np.ndarray", n_colors: int = 12) -> List[Tuple[str, float]]:
+        """Cluster with scikit-learn KMeans (slower, needs scikit-learn)."""
+        from sklearn.cluster import KMeans
+        
+        kmeans = KMeans(n_clusters=n_colors, random_state=42, n_init=10)
+        kmeans.fit(pixels.reshape(-1, 3)[::10])  # Sample every 10th pixel
+        population = np.bincount(kmeans.labels_, minlength=n_colors)
+        return ImageThemeGenerator.rank_palette(kmeans.cluster_centers_, population)
+    
+    @staticmethod
+    def load_analysis_image(image_path: str, size: int = 150) -> "Image.Image":
+        """Decode an image straight to a small RGB thumbnail for color analysis.
+        
+        The file is memory-mapped rather than read into memory. JPEGs are decoded
+        at 1/2-1/8 scale in the DCT domain via draft(), so their memory and time
+        stay roughly flat regardless of the wallpaper's resolution. Other formats
+        (PNG, WebP, ...) are still decoded at full size, then box reduced by an
+        integer factor before the final resample.
+        """
+        with open(uri_to_path(image_path), 'rb') as f:
+            try:
+                source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                source = f  # Empty or unmappable file, let PIL report it
+            try:
+                with Image.open(source) as img:
+                    img.draft('RGB', (size, size))
+                    # reduce() only handles 8-bit modes; palette, 1-bit and 16-bit images convert first
+                    if img.mode not in ('RGB', 'RGBA', 'L', 'LA', 'CMYK'):
+                        img = img.convert('RGB')
+                    reduce_by = (max(1, img.width // size), max(1, img.height // size))
+                    if reduce_by != (1, 1):
+                        img = img.reduce(reduce_by)
+                    return img.convert('RGB').resize((size, size))
+            finally:
+                if source is not f:
+                    source.close()
+    
+    @staticmethod
+    def extract_weighted_colors(image_path: str, n_colors: int = 12, method: str = "kmeans",
+                                **options) -> List[Tuple[str, float]]:
+        """Extract dominant colors with their population share, most common first.
         
-        while ratio < min_ratio and (step < 0 and factor > min_factor or step > 0 and factor < min_factor):
-            adjusted = ImageThemeGenerator.adjust_brightness(fg_rgb, factor)
-            fg_color = ImageThemeGenerator.rgb_to_hex(adjusted)
-            ratio = ImageThemeGenerator.get_contrast_ratio(fg_color, bg_color)
-            factor += step
+        method names a backend in PALETTE_EXTRACTORS; options are passed on to
+        it (e.g. max_iter and time_budget for kmeans).
+        """
+        extractor = PALETTE_EXTRACTORS[method]
+        with tracer.span("decode"):
+            img = ImageThemeGenerator.load_analysis_image(image_path, 150)
+            pixels = np.asarray(img).reshape(-1, 3)
         
-        return fg_color
+        with tracer.span("cluster", method=method):
+            return extractor(pixels, n_colors, **options)
+    
+    @staticmethod
+    def extract_dominant_colors(image_path: str, n_colors: int = 12, method: str = "kmeans") -> List[str]:
+        """Extract dominant colors from an image."""
+        return [color for color, _ in
+                ImageThemeGenerator.extract_weighted_colors(image_path, n_colors, method)]
+    
+    @staticmethod
+    def solve_contrast(fg_color: str, bg_color: str, min_ratio: float = 4.5) -> Tuple[str, bool]:
+        """Return the closest color to fg_color reaching min_ratio, and whether it was reachable."""
+        adjusted, reached = ColorEngine.solve_contrast(
+            ColorEngine.to_array(fg_color), ColorEngine.to_array(bg_color), min_ratio
+        )
+        return ColorEngine.to_hex(adjusted)[0], bool(reached[0])
+    
+    @staticmethod
+    def ensure_contrast(fg_color: str, bg_color: str, min_ratio: float = 4.5) -> str:
+        """Ensure foreground color has sufficient contrast with background."""
+        color, reached = ImageThemeGenerator.solve_contrast(fg_color, bg_color, min_ratio)
+        if not reached:
+            print(f"  ⚠ Contrast {min_ratio}:1 against {bg_color} is unreachable, using {color}")
+        return color
     
     @classmethod
     def generate_theme_from_image(cls, image_path: str, theme_name: str = "wallpaper",
-                                 variant: str = "dark") -> Dict[str, Any]:
-        """Generate complete theme from image."""
-        colors = cls.extract_dominant_colors(image_path, n_colors=12)
+                                 variant: str = "dark", colors: List[str] = None) -> Dict[str, Any]:
+        """Generate complete theme from image (or from already extracted colors)."""
+        if colors is None:
+            colors = cls.extract_dominant_colors(image_path, n_colors=12)
+        if len(colors) < cls.MIN_COLORS:
+            # Flat images cluster into a color or two; fill in with shades of what is there
+            missing = cls.MIN_COLORS - len(colors)
+            sources = [colors[i % len(colors)] for i in range(missing)]
+            colors = list(colors) + ColorEngine.to_hex(ColorEngine.scale_brightness(
+                ColorEngine.to_array(sources), np.geomspace(0.4, 1.6, missing)))
         is_dark = variant == "dark"
         
-        colors_sorted = sorted(colors, key=lambda c: cls.get_luminance(cls.hex_to_rgb(c)))
+        rgb = ColorEngine.to_array(colors)
+        order = np.argsort(ColorEngine.luminance(rgb), kind="stable")
+        colors_sorted = [colors[i] for i in order]
         
         if is_dark:
             background = colors_sorted[0]
             foreground = colors_sorted[-1]
-            bg_rgb = cls.hex_to_rgb(background)
-            if cls.get_luminance(bg_rgb) > 0.1:
-                background = cls.rgb_to_hex(cls.adjust_brightness(bg_rgb, 0.5))
-            foreground = cls.ensure_contrast(foreground, background, min_ratio=7.0)
+            if ColorEngine.luminance(ColorEngine.to_array(background))[0] > 0.1:
+                background = cls.rgb_to_hex(cls.adjust_brightness(cls.hex_to_rgb(background), 0.5))
         else:
             background = colors_sorted[-1]
             foreground = colors_sorted[0]
-            bg_rgb = cls.hex_to_rgb(background)
-            if cls.get_luminance(bg_rgb) < 0.9:
-                background = cls.rgb_to_hex(cls.adjust_brightness(bg_rgb, 1.3))
-            foreground = cls.ensure_contrast(foreground, background, min_ratio=7.0)
+            if ColorEngine.luminance(ColorEngine.to_array(background))[0] < 0.9:
+                background = cls.rgb_to_hex(cls.adjust_brightness(cls.hex_to_rgb(background), 1.3))
+        foreground = cls.ensure_contrast(foreground, background, min_ratio=7.0)
         
         accent_colors = colors_sorted[3:9] if len(colors_sorted) > 9 else colors_sorted[2:6]
         
-        ansi_colors = [background, colors_sorted[1]] + accent_colors[:6]
-        ansi_colors = ansi_colors[:8] + [cls.rgb_to_hex(cls.adjust_brightness(cls.hex_to_rgb(c), 1.3))
-                                          for c in ansi_colors[:8]]
+        ansi_colors = ([background, colors_sorted[1]] + accent_colors[:6])[:8]
+        ansi_colors += ColorEngine.to_hex(
+            ColorEngine.scale_brightness(ColorEngine.to_array(ansi_colors), 1.3))
         ansi_colors = (ansi_colors + [foreground] * 16)[:16]
         
         accent = accent_colors[0] if accent_colors else colors_sorted[len(colors_sorted)//2]
         cursor = accent_colors[1] if len(accent_colors) > 1 else accent
-        cursor = cls.ensure_contrast(cursor, background, min_ratio=3.0)
-        
-        sel_bg_rgb = cls.hex_to_rgb(accent)
-        selection_bg = cls.rgb_to_hex(cls.adjust_brightness(sel_bg_rgb, 0.4 if is_dark else 1.6))
-        
-        bg_rgb = cls.hex_to_rgb(background)
-        card = cls.rgb_to_hex(cls.adjust_brightness(bg_rgb, 0.9 if is_dark else 1.02))
-        popover = cls.rgb_to_hex(cls.adjust_brightness(bg_rgb, 1.1 if is_dark else 0.98))
-        headerbar = cls.rgb_to_hex(cls.adjust_brightness(bg_rgb, 0.7 if is_dark else 1.05))
-        
-        fg_rgb = cls.hex_to_rgb(foreground)
-        sidebar_fg = cls.rgb_to_hex(cls.adjust_brightness(fg_rgb, 0.7))
-        headerbar_fg = cls.rgb_to_hex(cls.adjust_brightness(fg_rgb, 0.6))
+        solved, reached = ColorEngine.solve_contrast(
+            ColorEngine.to_array([cursor, foreground, accent]),
+            ColorEngine.to_array([background, accent, background]),
+            [3.0, 4.5, 3.0]
+        )
+        if not reached.all():
+            print("  ⚠ Some generated colors could not reach their target contrast")
+        cursor, accent_fg, border = ColorEngine.to_hex(solved)
+        
+        # Derive every shaded variant in a single batched brightness pass
+        bg_factors = [0.9, 1.1, 0.7] if is_dark else [1.02, 0.98, 1.05]
+        shades = ColorEngine.to_hex(ColorEngine.scale_brightness(
+            ColorEngine.to_array([accent] + [background] * 3 + [foreground] * 2),
+            [0.4 if is_dark else 1.6] + bg_factors + [0.7, 0.6]
+        ))
+        selection_bg, card, popover, headerbar, sidebar_fg, headerbar_fg = shades
         
         theme = {
             "name": f"{theme_name.title()} (Auto-generated)",
@@ -224,8 +1057,8 @@ class ImageThemeGenerator:
                 "palette": ansi_colors,
                 "semantic": {
                     "accent": accent,
-                    "accent_fg": cls.ensure_contrast(foreground, accent, min_ratio=4.5),
-                    "border": cls.ensure_contrast(accent, background, min_ratio=3.0),
+                    "accent_fg": accent_fg,
+                    "border": border,
                     "success": ansi_colors[2],
                     "warning": ansi_colors[3],
                     "error": ansi_colors[1]
@@ -246,12 +1079,716 @@ class ImageThemeGenerator:
         return theme
 
 
+# Palette extraction backends: name -> fn(pixels, n_colors) -> [(hex, share)], most common first
+PALETTE_EXTRACTORS = {
+    "kmeans": ImageThemeGenerator.kmeans_palette,
+    "histogram": ImageThemeGenerator.histogram_palette,
+    "mediancut": ImageThemeGenerator.mediancut_palette,
+    "pil": ImageThemeGenerator.pil_palette,
+    "sklearn": ImageThemeGenerator.sklearn_palette,
+}
+
+
+class WallpaperPalette:
+    """Weighted dominant colors of an image, analysed once.
+    
+    Decoding and clustering are the expensive part of a wallpaper theme;
+    deriving a variant from the palette only sorts and adjusts a dozen
+    colors, so dark and light themes both come from one analysis.
+    """
+    
+    VARIANTS = ("dark", "light")
+    
+    def __init__(self, weighted: List[Tuple[str, float]]):
+        self.weighted = [(color, float(share)) for color, share in weighted]
+    
+    @classmethod
+    def from_image(cls, image_path: str, n_colors: int = 12, method: str = "kmeans",
+                   **options) -> "WallpaperPalette":
+        return cls(ImageThemeGenerator.extract_weighted_colors(str(image_path), n_colors, method, **options))
+    
+    @property
+    def colors(self) -> List[str]:
+        return [color for color, _ in self.weighted]
+    
+    def derive(self, variant: str, theme_name: str = "wallpaper") -> Dict[str, Any]:
+        """Build the theme for one variant without touching the image."""
+        return ImageThemeGenerator.generate_theme_from_image(
+            None, theme_name=theme_name, variant=variant, colors=self.colors
+        )
+    
+    def derive_all(self, theme_name: str = "wallpaper") -> Dict[str, Dict[str, Any]]:
+        return {variant: self.derive(variant, theme_name) for variant in self.VARIANTS}
+    
+    def to_json(self) -> List[List[Any]]:
+        return [[color, share] for color, share in self.weighted]
+
+
+class StyleTemplate:
+    """A CSS/SCSS file parsed once into literal text and named color slots.
+    
+    GTK files declare colors as `@define-color name value;` and the Shell SCSS
+    as `$name: value;`. Parsed templates are cached per file and keyed by its
+    (size, mtime), so re-rendering a file is a single linear join.
+    """
+    
+    GTK = "gtk"
+    SCSS = "scss"
+    PATTERNS = {
+        GTK: re.compile(r'@define-color\s+([A-Za-z0-9_-]+)\s+([^;]+);'),
+        SCSS: re.compile(r'(?m)^[ \t]*\$([A-Za-z0-9_-]+)[ \t]*:[ \t]*([^;]+);'),
+    }
+    ALPHA = re.compile(r'alpha\(\s*[^,]+,\s*([^)]+)\)')
+    
+    _cache: Dict[Tuple[str, str], Tuple[Tuple[int, int], "StyleTemplate"]] = {}
+    
+    def __init__(self, literals: List[str], names: List[str], values: List[str]):
+        # literals has one more entry than names/values: lit0 val0 lit1 val1 ... litN
+        self.literals = literals
+        self.names = names
+        self.values = values
+    
+    @classmethod
+    def parse(cls, text: str, syntax: str) -> "StyleTemplate":
+        """Split text into literals and variable values."""
+        literals, names, values = [], [], []
+        position = 0
+        for match in cls.PATTERNS[syntax].finditer(text):
+            literals.append(text[position:match.start(2)])
+            names.append(match.group(1))
+            values.append(match.group(2))
+            position = match.end(2)
+        literals.append(text[position:])
+        return cls(literals, names, values)
+    
+    @staticmethod
+    def _signature(path: Path) -> Tuple[int, int]:
+        st = path.stat()
+        return (st.st_size, st.st_mtime_ns)
+    
+    @classmethod
+    def load(cls, path: Path, syntax: str) -> "StyleTemplate":
+        """Return the parsed template for a file, reusing the cached parse if unchanged."""
+        key = (str(path), syntax)
+        signature = cls._signature(path)
+        cached = cls._cache.get(key)
+        if cached and cached[0] == signature:
+            return cached[1]
+        with open(path, 'r') as f:
+            template = cls.parse(f.read(), syntax)
+        cls._cache[key] = (signature, template)
+        return template
+    
+    @classmethod
+    def remember(cls, path: Path, syntax: str, template: "StyleTemplate"):
+        """Cache a freshly rendered template as the current parse of path."""
+        cls._cache[(str(path), syntax)] = (cls._signature(path), template)
+    
+    @property
+    def text(self) -> str:
+        parts = [self.literals[0]]
+        for value, literal in zip(self.values, self.literals[1:]):
+            parts.append(value)
+            parts.append(literal)
+        return "".join(parts)
+    
+    def render(self, values: Dict[str, str]) -> Tuple["StyleTemplate", List[str], List[str]]:
+        """Substitute variables in one pass.
+        
+        Returns the rendered template, the names whose value changed, and the
+        requested names that do not occur in the file.
+        """
+        rendered = []
+        changed = []
+        for name, old in zip(self.names, self.values):
+            new = values.get(name)
+            if new is None:
+                rendered.append(old)
+                continue
+            alpha = self.ALPHA.fullmatch(old.strip())
+            if alpha:
+                new = f"alpha({new}, {alpha.group(1)})"
+            if new != old and name not in changed:
+                changed.append(name)
+            rendered.append(new)
+        
+        present = set(self.names)
+        missing = [name for name in values if name not in present]
+        return StyleTemplate(self.literals, self.names, rendered), changed, missing
+
+
+class ThemeRegistry:
+    """Compiled index of themes/*.json.
+    
+    The index is a single JSON file holding every theme plus columnar arrays
+    (names, variants, authors and key colors) for fast filtering. It records
+    each theme file's mtime and is rebuilt automatically when any of them
+    changes, or when a theme is added or removed.
+    """
+    
+    INDEX_VERSION = 1
+    KEY_COLORS = {
+        "background": ("base", "background"),
+        "foreground": ("base", "foreground"),
+        "accent": ("semantic", "accent"),
+    }
+    
+    def __init__(self, themes_dir: Path, index_file: Path):
+        self.themes_dir = Path(themes_dir)
+        self.index_file = Path(index_file)
+        self._index: Optional[Dict[str, Any]] = None
+    
+    def _sources(self) -> Dict[str, int]:
+        """Map theme name -> file mtime for every theme file."""
+        sources = {}
+        try:
+            with os.scandir(self.themes_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".json") and entry.is_file():
+                        sources[entry.name[:-5]] = entry.stat().st_mtime_ns
+        except FileNotFoundError:
+            pass
+        return sources
+    
+    def build(self, sources: Dict[str, int]) -> Dict[str, Any]:
+        """Parse every theme file and pack the index."""
+        index = {
+            "version": self.INDEX_VERSION,
+            "sources": sources,
+            "names": [],
+            "titles": [],
+            "variants": [],
+            "authors": [],
+            "colors": {key: [] for key in self.KEY_COLORS},
+            "palettes": [],
+            "themes": {},
+        }
+        for name in sorted(sources):
+            try:
+                with open(self.themes_dir / f"{name}.json", 'r') as f:
+                    theme = json.load(f)
+                colors = theme["colors"]
+                key_colors = {key: colors[section].get(field, colors["base"]["background"])
+                              for key, (section, field) in self.KEY_COLORS.items()}
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"  ⚠ Skipping invalid theme {name}: {e}")
+                continue
+            index["names"].append(name)
+            index["titles"].append(theme.get("name", name))
+            index["variants"].append(theme.get("variant", "dark"))
+            index["authors"].append(theme.get("author", ""))
+            for key, value in key_colors.items():
+                index["colors"][key].append(value)
+            index["palettes"].append(colors.get("palette", []))
+            index["themes"][name] = theme
+        return index
+    
+    def load(self) -> Dict[str, Any]:
+        """Return the current index, rebuilding it if any theme file changed."""
+        sources = self._sources()
+        if self._index is not None and self._index["sources"] == sources:
+            return self._index
+        
+        try:
+            with open(self.index_file, 'r') as f:
+                index = json.load(f)
+            if index.get("version") == self.INDEX_VERSION and index.get("sources") == sources:
+                self._index = index
+                return index
+        except (OSError, ValueError):
+            pass
+        
+        index = self.build(sources)
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.index_file.with_name(f".{self.index_file.name}.tmp")
+            with open(tmp, 'w') as f:
+                json.dump(index, f, separators=(',', ':'))
+            os.replace(tmp, self.index_file)
+        except OSError:
+            pass  # Read-only cache, keep the index in memory only
+        self._index = index
+        return index
+    
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of a theme, or None if it is not in the registry."""
+        theme = self.load()["themes"].get(name)
+        return copy.deepcopy(theme) if theme is not None else None
+    
+    def palette_tensor(self) -> Tuple[List[str], List[str], "np.ndarray"]:
+        """Return names, variants and a (themes, 19, 3) OKLab tensor of key + palette colors.
+        
+        Rows are background, foreground, accent, then the 16 palette colors
+        (short palettes are padded with the background). The tensor is rebuilt
+        only when the index changes.
+        """
+        index = self.load()
+        if getattr(self, "_tensor_for", None) is not index:
+            rows = []
+            for i, palette in enumerate(index["palettes"]):
+                background = index["colors"]["background"][i]
+                keys = [index["colors"][key][i] for key in self.KEY_COLORS]
+                rows.extend(keys + (list(palette) + [background] * 16)[:16])
+            lab = ColorSpace.srgb_to_oklab(ColorEngine.to_array(rows)) if rows else np.empty((0, 3))
+            self._tensor = lab.reshape(len(index["names"]), 3 + 16, 3)
+            self._tensor_for = index
+        return index["names"], index["variants"], self._tensor
+    
+    def query(self, variant: str = None, author: str = None) -> List[str]:
+        """Theme names matching a variant and/or author substring, answered from the index."""
+        index = self.load()
+        author = author.lower() if author else None
+        return [name for name, theme_variant, theme_author
+                in zip(index["names"], index["variants"], index["authors"])
+                if (variant is None or theme_variant == variant)
+                and (author is None or author in theme_author.lower())]
+
+
+class ContrastAudit:
+    """WCAG contrast checks over every theme in the registry in one vectorized pass.
+    
+    Each check pairs a foreground color with the background it is drawn on and
+    a minimum ratio: 4.5:1 for text, 3:1 for the cursor, status colors and the
+    terminal's normal and bright colors 1-6. A theme color is addressed by
+    (section, key), or ("palette", index) for the ANSI palette.
+    """
+    
+    TEXT, UI = 4.5, 3.0
+    CHECKS = {
+        "foreground": (("base", "foreground"), ("base", "background"), TEXT),
+        "selection": (("base", "selection_fg"), ("base", "selection_bg"), TEXT),
+        "accent": (("semantic", "accent_fg"), ("semantic", "accent"), TEXT),
+        "card": (("ui", "card_fg"), ("ui", "card"), TEXT),
+        "popover": (("ui", "popover_fg"), ("ui", "popover"), TEXT),
+        "sidebar": (("ui", "sidebar_fg"), ("ui", "sidebar"), TEXT),
+        "headerbar": (("ui", "headerbar_fg"), ("ui", "headerbar"), TEXT),
+        "cursor": (("base", "cursor"), ("base", "background"), UI),
+        "success": (("semantic", "success"), ("base", "background"), UI),
+        "warning": (("semantic", "warning"), ("base", "background"), UI),
+        "error": (("semantic", "error"), ("base", "background"), UI),
+    }
+    for _i in (*range(1, 7), *range(9, 15)):
+        CHECKS[f"color{_i}"] = (("palette", _i), ("base", "background"), UI)
+    del _i
+    
+    def __init__(self, registry: "ThemeRegistry"):
+        self.registry = registry
+    
+    @staticmethod
+    def lookup(colors: Dict[str, Any], path: Tuple[str, Any]) -> Optional[str]:
+        """Color at a (section, key) path, or None if the theme does not define it."""
+        section, key = path
+        try:
+            value = colors[section][key]
+        except (KeyError, IndexError, TypeError):
+            return None
+        return value if isinstance(value, str) and re.fullmatch(r'#[0-9A-Fa-f]{6}', value) else None
+    
+    def run(self, names: List[str]) -> List[Dict[str, Any]]:
+        """Return every failing check of the named themes, furthest below its minimum first."""
+        themes = self.registry.load()["themes"]
+        checks = list(self.CHECKS.items())
+        fg, bg, defined = [], [], []
+        for name in names:
+            colors = themes[name]["colors"]
+            for _, (fg_path, bg_path, _) in checks:
+                pair = (self.lookup(colors, fg_path), self.lookup(colors, bg_path))
+                defined.append(None not in pair)
+                fg.append(pair[0] or "#000000")
+                bg.append(pair[1] or "#000000")
+        if not fg:
+            return []
+        
+        minimum = np.tile([ratio for _, (_, _, ratio) in checks], len(names))
+        ratios = ColorEngine.contrast(ColorEngine.to_array(fg), ColorEngine.to_array(bg))
+        failing = np.flatnonzero((ratios < minimum) & np.array(defined))
+        failing = failing[np.argsort(ratios[failing] / minimum[failing], kind="stable")]
+        
+        violations = []
+        for i in failing.tolist():
+            check, (fg_path, bg_path, _) = checks[i % len(checks)]
+            violations.append({
+                "theme": names[i // len(checks)],
+                "check": check,
+                "fg_path": list(fg_path),
+                "bg_path": list(bg_path),
+                "fg": fg[i],
+                "bg": bg[i],
+                "ratio": round(float(ratios[i]), 2),
+                "min": float(minimum[i]),
+            })
+        return violations
+    
+    def fix(self, violations: List[Dict[str, Any]]) -> int:
+        """Solve every violation in one batch and rewrite the theme files.
+        
+        Each violation gets "fixed" (the new color) or "unreachable"; no check
+        reads a color another check changes, so all of them are solved at once.
+        Returns the number of theme files written.
+        """
+        if not violations:
+            return 0
+        solved, reached = ColorEngine.solve_contrast(
+            ColorEngine.to_array([v["fg"] for v in violations]),
+            ColorEngine.to_array([v["bg"] for v in violations]),
+            [v["min"] for v in violations])
+        
+        by_theme: Dict[str, List[Dict[str, Any]]] = {}
+        for violation, color, ok in zip(violations, ColorEngine.to_hex(solved), reached.tolist()):
+            if ok:
+                violation["fixed"] = color
+                by_theme.setdefault(violation["theme"], []).append(violation)
+            else:
+                violation["unreachable"] = True
+        
+        for name, fixes in by_theme.items():
+            theme_file = self.registry.themes_dir / f"{name}.json"
+            with open(theme_file, 'r') as f:
+                text = f.read()
+            theme = json.loads(text)
+            for violation in fixes:
+                section, key = violation["fg_path"]
+                theme["colors"][section][key] = violation["fixed"]
+            tmp = theme_file.with_name(f".{theme_file.name}.tmp")
+            with open(tmp, 'w') as f:
+                f.write(json.dumps(theme, indent=2, ensure_ascii=False) + ("\n" if text.endswith("\n") else ""))
+            os.replace(tmp, theme_file)
+        return len(by_theme)
+
+
+class TargetPipeline:
+    """Run apply steps concurrently while honouring declared dependencies.
+    
+    Steps start as soon as every step they come after has finished; a step
+    whose dependency failed is not run. Results are returned in declared order.
+    """
+    
+    def __init__(self):
+        self.steps: List[Tuple[str, Any, Tuple[str, ...]]] = []
+    
+    def add(self, name: str, fn, after: Tuple[str, ...] = ()):
+        """Register a step; `after` names steps that must succeed first."""
+        self.steps.append((name, fn, tuple(after)))
+    
+    @staticmethod
+    def _timed(name: str, fn, parent: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            with tracer.span(name, parent=parent):
+                result = fn()
+            return {"ok": True, "result": result, "error": None,
+                    "seconds": time.perf_counter() - start}
+        except Exception as e:
+            return {"ok": False, "result": None, "error": e,
+                    "seconds": time.perf_counter() - start}
+    
+    def run(self) -> Dict[str, Dict[str, Any]]:
+        """Run every step and return {name: {ok, result, error, seconds}}."""
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+        
+        results: Dict[str, Dict[str, Any]] = {}
+        pending = {name: (fn, after) for name, fn, after in self.steps}
+        parent = tracer.current()
+        
+        with ThreadPoolExecutor(max_workers=max(1, len(self.steps))) as pool:
+            running = {}
+            while pending or running:
+                for name in list(pending):
+                    fn, after = pending[name]
+                    failed = [dep for dep in after if dep in results and not results[dep]["ok"]]
+                    if failed:
+                        results[name] = {"ok": False, "result": None, "seconds": 0.0,
+                                         "error": RuntimeError(f"skipped because {failed[0]} failed")}
+                        del pending[name]
+                    elif all(dep in results for dep in after):
+                        running[pool.submit(self._timed, name, fn, parent)] = name
+                        del pending[name]
+                
+                if not running:
+                    # Whatever is left waits on steps that were never declared
+                    for name, (_, after) in pending.items():
+                        results[name] = {"ok": False, "result": None, "seconds": 0.0,
+                                         "error": RuntimeError(f"unknown dependency in {after}")}
+                    break
+                
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        
+        return {name: results[name] for name, _, _ in self.steps}
+
+
+class JobCancelled(Exception):
+    """Raised inside a background job that a newer submission superseded."""
+
+
+class ApplyWorker:
+    """Run theme applies on one background thread, newest request wins.
+    
+    submit() never blocks the caller: it numbers the job and puts it in a
+    single pending slot, dropping any job that has not started yet. A running
+    job that has been superseded stops at its next checkpoint() with
+    JobCancelled. Completion callbacks are posted to the GLib main loop.
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending: Optional[Tuple[int, str, Any, Any]] = None
+        self._latest = 0
+        self._running: Optional[int] = None
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="polarify-worker", daemon=True)
+        self._thread.start()
+    
+    def submit(self, name: str, fn, done=None) -> int:
+        """Queue fn as the newest job; done(outcome) runs on the main loop afterwards."""
+        with self._cond:
+            self._latest += 1
+            if self._pending is not None:
+                print(f"   (dropped queued job: {self._pending[1]})")
+            self._pending = (self._latest, name, fn, done)
+            self._cond.notify()
+            return self._latest
+    
+    def checkpoint(self):
+        """Abort the current job if a newer one was submitted (worker thread only)."""
+        if threading.current_thread() is not self._thread:
+            return
+        with self._cond:
+            if self._running is not None and self._running != self._latest:
+                raise JobCancelled(f"job {self._running} superseded by job {self._latest}")
+    
+    def stop(self, timeout: float = 5.0):
+        with self._cond:
+            self._stopping = True
+            self._pending = None
+            self._cond.notify()
+        self._thread.join(timeout)
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                seq, name, fn, done = self._pending
+                self._pending = None
+                self._running = seq
+            
+            outcome = {"seq": seq, "name": name, "ok": False, "cancelled": False,
+                       "result": None, "error": None}
+            try:
+                outcome["result"] = fn()
+                outcome["ok"] = True
+            except JobCancelled:
+                outcome["cancelled"] = True
+            except Exception as e:
+                outcome["error"] = e
+            
+            with self._cond:
+                self._running = None
+                outcome["stale"] = seq != self._latest
+            if done is not None:
+                self._post(done, outcome)
+    
+    @staticmethod
+    def _post(done, outcome: Dict[str, Any]):
+        def deliver():
+            done(outcome)
+            return False
+        
+        if GNOME_AVAILABLE:
+            GLib.idle_add(deliver)
+        else:
+            deliver()
+
+
+class TerminalRecolor:
+    """Recolor open terminals in place with OSC escape sequences.
+    
+    Terminals come from the tty registry filled by the fish and bash hooks
+    (one file per interactive shell, named after its pid and holding its tty),
+    or, when no registered shell is alive, from every /dev/pts device owned by
+    the user. Each one gets the palette (OSC 4), foreground, background and
+    cursor (OSC 10/11/12) and selection colors (OSC 17/19) in a single
+    non-blocking write, so a busy or suspended terminal never stalls an apply
+    (beyond a short wait to end a sequence a full buffer cut off).
+    """
+    
+    # OSC code -> (section, key) in theme colors
+    DYNAMIC_COLORS = {
+        10: ("base", "foreground"),
+        11: ("base", "background"),
+        12: ("base", "cursor"),
+        17: ("base", "selection_bg"),
+        19: ("base", "selection_fg"),
+    }
+    
+    # Seconds to wait for room to end a sequence cut off by a short write
+    TERMINATE_TIMEOUT = 0.2
+    
+    @staticmethod
+    def registry_dir() -> Optional[Path]:
+        runtime = os.environ.get('XDG_RUNTIME_DIR')
+        return Path(runtime) / "polarify-ttys" if runtime else None
+    
+    @staticmethod
+    def osc_color(color: str) -> str:
+        value = color.lstrip('#')
+        return f"rgb:{value[0:2]}/{value[2:4]}/{value[4:6]}"
+    
+    @classmethod
+    def sequences(cls, theme: Dict[str, Any]) -> bytes:
+        """Every OSC sequence for a theme, concatenated."""
+        colors = theme["colors"]
+        palette = ";".join(f"{i};{cls.osc_color(color)}" for i, color in enumerate(colors["palette"]))
+        parts = [f"\033]4;{palette}\a"]
+        for code, (section, key) in cls.DYNAMIC_COLORS.items():
+            color = colors.get(section, {}).get(key)
+            if color:
+                parts.append(f"\033]{code};{cls.osc_color(color)}\a")
+        return "".join(parts).encode()
+    
+    @classmethod
+    def terminals(cls) -> List[str]:
+        """TTY paths of the user's open terminals."""
+        ttys = set()
+        registry = cls.registry_dir()
+        if registry is not None and registry.is_dir():
+            for entry in registry.iterdir():
+                if not Path(f"/proc/{entry.name}").exists():
+                    entry.unlink(missing_ok=True)  # The shell has exited
+                    continue
+                try:
+                    ttys.add(entry.read_text().strip())
+                except OSError:
+                    pass
+        if not ttys:
+            ttys.update(str(path) for path in Path("/dev/pts").glob("[0-9]*"))
+        
+        uid = os.getuid()
+        owned = []
+        for tty in sorted(ttys):
+            try:
+                info = os.stat(tty)
+            except OSError:
+                continue
+            if stat.S_ISCHR(info.st_mode) and info.st_uid == uid:
+                owned.append(tty)
+        return owned
+    
+    @classmethod
+    def push(cls, theme: Dict[str, Any]) -> int:
+        """Send the theme to every open terminal; return how many were recolored."""
+        payload = cls.sequences(theme)
+        recolored = 0
+        for tty in cls.terminals():
+            try:
+                fd = os.open(tty, os.O_WRONLY | os.O_NOCTTY | os.O_NONBLOCK)
+            except OSError:
+                continue
+            try:
+                if not select.select([], [fd], [], 0)[1]:
+                    continue  # Output buffer full (terminal not reading); skip it
+                written = os.write(fd, payload)
+                if written == len(payload):
+                    recolored += 1
+                elif written:
+                    cls.terminate(fd, payload[:written])
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+        return recolored
+    
+    @classmethod
+    def terminate(cls, fd: int, sent: bytes):
+        """Close the sequence a short write cut off, so the tty is not left inside an OSC."""
+        if sent.endswith(b"\a"):
+            return
+        # The short write filled the buffer, so give the terminal a moment to drain.
+        # A dangling ESC becomes ST (ESC \\); anything later in an OSC ends at BEL
+        with contextlib.suppress(OSError):
+            if select.select([], [fd], [], cls.TERMINATE_TIMEOUT)[1]:
+                os.write(fd, b"\\" if sent.endswith(b"\033") else b"\a")
+
+
 class ThemeManager:
+    # @define-color name in gtk-4.0/themes/hypaurora.css -> (section, key) in theme colors
+    GTK_COLORS = {
+        "destructive_bg_color": ("semantic", "error"),
+        "destructive_fg_color": ("base", "background"),
+        "destructive_color": ("semantic", "error"),
+        "success_bg_color": ("semantic", "success"),
+        "success_fg_color": ("base", "foreground"),
+        "success_color": ("semantic", "success"),
+        "warning_bg_color": ("semantic", "warning"),
+        "warning_fg_color": ("base", "foreground"),
+        "warning_color": ("semantic", "warning"),
+        "error_bg_color": ("semantic", "error"),
+        "error_fg_color": ("base", "foreground"),
+        "error_color": ("semantic", "error"),
+        "window_bg_color": ("base", "background"),
+        "window_fg_color": ("base", "foreground"),
+        "view_bg_color": ("base", "background"),
+        "view_fg_color": ("base", "foreground"),
+        "headerbar_bg_color": ("ui", "headerbar"),
+        "headerbar_fg_color": ("ui", "headerbar_fg"),
+        "headerbar_backdrop_color": ("ui", "headerbar"),
+        "headerbar_shade_color": ("ui", "headerbar"),
+        "card_bg_color": ("ui", "card"),
+        "card_fg_color": ("ui", "card_fg"),
+        "card_shade_color": ("ui", "card"),
+        "popover_bg_color": ("ui", "popover"),
+        "popover_fg_color": ("ui", "popover_fg"),
+        "sidebar_backdrop_color": ("ui", "sidebar"),
+        "sidebar_bg_color": ("ui", "sidebar"),
+        "sidebar_fg_color": ("ui", "sidebar_fg"),
+    }
+    
+    # $variable in gnome-shell-sass/_colors-override.scss -> (section, key) in theme colors
+    SHELL_COLORS = {
+        "_base_color_dark": ("base", "background"),
+        "_base_color_light": ("base", "foreground"),
+        "base_color": ("base", "background"),
+        "bg_color": ("base", "background"),
+        "fg_color": ("base", "foreground"),
+        "osd_bg_color": ("base", "background"),
+        "osd_fg_color": ("base", "foreground"),
+        "panel_bg_color": ("ui", "headerbar"),
+        "panel_fg_color": ("base", "foreground"),
+        "card_bg_color": ("ui", "card"),
+        "system_base_color": ("base", "background"),
+        "system_fg_color": ("base", "foreground"),
+        "success_color": ("semantic", "success"),
+        "warning_color": ("semantic", "warning"),
+        "error_color": ("semantic", "error"),
+        "destructive_color": ("semantic", "error"),
+        "selected_bg_color": ("base", "selection_bg"),
+        "selected_fg_color": ("base", "selection_fg"),
+    }
+    
+    # Bump when theme generation changes so cached wallpaper themes are rebuilt
+    GENERATOR_VERSION = 3
+    WALLPAPER_PARAMS = {"n_colors": 12, "method": "kmeans"}
+    WALLPAPER_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+    
     def __init__(self, base_dir: Path = None):
         self.base_dir = base_dir or Path(__file__).parent
         self.themes_dir = self.base_dir / "themes"
         self.config_file = self.base_dir / "theme-config.json"
         self._is_gnome = None
+        self._settings: Dict[str, Any] = {}
+        self.worker: Optional[ApplyWorker] = None
+        self.extractor: Optional[str] = None
+        self.live: Optional[bool] = None
+        # Entries are a few KiB; room for a whole pre-generated wallpaper folder
+        self.theme_cache = DiskCache(cache_dir() / "wallpaper", max_entries=2048)
+        self.file_hashes = FileChangeDetector()
+        self.shell_css_cache = DiskCache(cache_dir() / "gnome-shell", max_entries=128)
+        themes_key = hashlib.blake2b(str(self.themes_dir.resolve()).encode(), digest_size=6).hexdigest()
+        self.registry = ThemeRegistry(self.themes_dir, cache_dir() / f"registry-{themes_key}.json")
     
     @property
     def is_gnome(self) -> bool:
@@ -262,13 +1799,12 @@ class ThemeManager:
         return self._is_gnome
     
     def load_theme(self, theme_name: str) -> Dict[str, Any]:
-        """Load theme JSON file."""
-        theme_file = self.themes_dir / f"{theme_name}.json"
-        if not theme_file.exists():
+        """Load theme from the registry index."""
+        theme = self.registry.get(theme_name)
+        if theme is None:
+            theme_file = self.themes_dir / f"{theme_name}.json"
             raise FileNotFoundError(f"Theme '{theme_name}' not found at {theme_file}")
-        
-        with open(theme_file, 'r') as f:
-            return json.load(f)
+        return theme
     
     def load_config(self) -> Dict[str, Any]:
         """Load theme configuration."""
@@ -286,9 +1822,9 @@ class ThemeManager:
         with open(self.config_file, 'w') as f:
             json.dump(config, f, indent=2)
     
-    def list_themes(self):
-        """List all available themes."""
-        themes = sorted([f.stem for f in self.themes_dir.glob("*.json")])
+    def list_themes(self, variant: str = None, author: str = None):
+        """List all available themes, optionally filtered by variant or author."""
+        themes = self.registry.query(variant=variant, author=author)
         config = self.load_config()
         current = config.get("current_theme", "")
         
@@ -296,10 +1832,11 @@ class ThemeManager:
         for theme in themes:
             marker = "→" if theme == current else " "
             print(f"  {marker} {theme}")
-        marker = "→" if current == "adwaita" else " "
-        print(f"  {marker} adwaita")
-        marker = "→" if current == "adwaita-dark" else " "
-        print(f"  {marker} adwaita-dark")
+        if not author:
+            for name, name_variant in (("adwaita", "light"), ("adwaita-dark", "dark")):
+                if variant in (None, name_variant):
+                    marker = "→" if current == name else " "
+                    print(f"  {marker} {name}")
         print(f"\nTotal: {len(themes)} themes")
     
     def preview_theme(self, theme_name: str):
@@ -326,13 +1863,19 @@ class ThemeManager:
             print(f"  color{i:2d}              {color}")
         print()
     
+    def settings(self, schema: str) -> "Gio.Settings":
+        """Return a GSettings handle for schema, reusing it across calls."""
+        if schema not in self._settings:
+            self._settings[schema] = Gio.Settings.new(schema)
+        return self._settings[schema]
+    
     def get_gnome_dark_mode(self) -> bool:
         """Check if GNOME is in dark mode."""
         if not GNOME_AVAILABLE:
             return True  # Default to dark if GNOME is not available
         
         try:
-            settings = Gio.Settings.new('org.gnome.desktop.interface')
+            settings = self.settings('org.gnome.desktop.interface')
             color_scheme = settings.get_string('color-scheme')
             return color_scheme == 'prefer-dark'
         except Exception:
@@ -347,18 +1890,12 @@ class ThemeManager:
             dark_mode = self.get_gnome_dark_mode()
         
         try:
-            settings = Gio.Settings.new('org.gnome.desktop.background')
+            settings = self.settings('org.gnome.desktop.background')
             key = 'picture-uri-dark' if dark_mode else 'picture-uri'
             uri = settings.get_string(key)
             
-            # Handle both 'file:///path' and '/path' formats
-            if uri.startswith('file://'):
-                return uri[7:]  # Remove 'file://' prefix
-            elif uri.startswith("'file://") and uri.endswith("'"):
-                return uri[8:-1]  # Remove 'file://' prefix and quotes
-            elif uri.startswith("'") and uri.endswith("'"):
-                return uri[1:-1]  # Remove quotes
-            return uri
+            # Handle 'file:///path' (percent-encoded, maybe quoted) and '/path' formats
+            return uri_to_path(uri)
         except Exception as e:
             print(f"  ⚠ Could not get GNOME wallpaper: {e}")
             return None
@@ -373,9 +1910,22 @@ class ThemeManager:
         print("Press Ctrl+C to stop\n")
         
         last_dark_mode = self.get_gnome_dark_mode()
+        # Theme of the newest submitted apply; the config only changes once it finishes
+        wanted_theme = self.load_config().get('current_theme')
+        
+        def on_applied(outcome):
+            nonlocal wanted_theme
+            if outcome["ok"]:
+                print(f"✓ Applied {outcome['name']}\n")
+            elif outcome["cancelled"]:
+                print(f"   Dropped {outcome['name']}, superseded by a newer switch\n")
+            else:
+                print(f"✗ Error applying theme: {outcome['error']}\n")
+                if not outcome["stale"]:
+                    wanted_theme = self.load_config().get('current_theme')
         
         def on_settings_changed(settings, key):
-            nonlocal last_dark_mode
+            nonlocal last_dark_mode, wanted_theme
             if key == 'color-scheme':
                 current_dark_mode = self.get_gnome_dark_mode()
                 if current_dark_mode != last_dark_mode:
@@ -386,19 +1936,17 @@ class ThemeManager:
                     config = self.load_config()
                     target_theme = config.get('preferred_dark_theme' if current_dark_mode 
                                             else 'preferred_light_theme')
-                    current_theme = config.get('current_theme')
                     
-                    if target_theme and target_theme != current_theme:
+                    if target_theme and target_theme != wanted_theme:
                         print(f"   Applying {target_theme}...\n")
-                        try:
-                            self.apply_theme(target_theme)
-                        except Exception as e:
-                            print(f"✗ Error applying theme: {e}\n")
+                        wanted_theme = target_theme
+                        self.worker.submit(target_theme, lambda: self.apply_theme(target_theme), on_applied)
                     else:
-                        print(f"   Already using {current_theme}\n")
+                        print(f"   Already using {wanted_theme}\n")
         
+        self.worker = ApplyWorker()
         try:
-            settings = Gio.Settings.new('org.gnome.desktop.interface')
+            settings = self.settings('org.gnome.desktop.interface')
             settings.connect('changed', on_settings_changed)
             
             loop = GLib.MainLoop()
@@ -408,11 +1956,135 @@ class ThemeManager:
         except Exception as e:
             print(f"Error: {e}")
             sys.exit(1)
+        finally:
+            self.worker.stop()
+            self.worker = None
     
-    def update_ghostty(self, theme: Dict[str, Any]) -> bool:
-        """Updates Ghostty theme file."""
+    def watch(self, debounce: float = 0.75):
+        """Watch dark mode and wallpaper changes in one event loop.
+        
+        Subscribes to org.gnome.desktop.interface and org.gnome.desktop.background
+        and monitors the wallpaper files. Events are debounced: every event
+        restarts a short timer, and only when it expires is the desired state
+        (mode, theme, wallpaper content) computed and applied once. A dark-mode
+        flip that also touches picture-uri-dark therefore causes a single rebuild.
+        Wallpaper themes follow the wallpaper only for a mode whose
+        preferred_*_theme is "wallpaper".
+        """
+        if not GNOME_AVAILABLE:
+            print("Error: This feature requires GNOME python library")
+            sys.exit(1)
+        
+        print("👁️  Watching GNOME dark mode and wallpaper for changes...")
+        print("Press Ctrl+C to stop\n")
+        
+        monitors = {}
+        timer = None
+        reasons = []
+        last_applied = None
+        wanted = None
+        
+        def desired_state() -> Tuple[Any, ...]:
+            """What should be applied right now, as a comparable tuple."""
+            dark = self.get_gnome_dark_mode()
+            mode = "dark" if dark else "light"
+            config = self.load_config()
+            preferred = config.get('preferred_dark_theme' if dark else 'preferred_light_theme')
+            # Only the preference decides; a one-off 'apply wallpaper' must not stick
+            if preferred == "wallpaper":
+                uri = self.get_gnome_wallpaper_uri(dark)
+                return ("wallpaper", mode, self.file_hashes.signature(uri) if uri else None)
+            return (preferred or config.get('current_theme'), mode, None)
+        
+        def on_applied(outcome, state):
+            nonlocal last_applied, wanted
+            if outcome["ok"]:
+                last_applied = state
+                print(f"✓ Applied {outcome['name']}\n")
+            elif outcome["cancelled"]:
+                print(f"   Dropped {outcome['name']}, superseded by a newer change\n")
+            else:
+                print(f"✗ Error applying theme: {outcome['error']}\n")
+            if not outcome["ok"] and not outcome["stale"]:
+                wanted = last_applied
+        
+        def flush():
+            nonlocal timer, wanted
+            timer = None
+            print(f"🔔 {', '.join(dict.fromkeys(reasons))} at {time.strftime('%H:%M:%S')}")
+            reasons.clear()
+            
+            state = desired_state()
+            theme_name, mode, _ = state
+            if state == wanted or (theme_name == "wallpaper" and state[2] is None):
+                print("   Nothing to do\n")
+                return False
+            
+            # Runs off the main loop; a newer state supersedes it
+            print(f"   Applying {theme_name} ({mode})...\n")
+            wanted = state
+            self.worker.submit(f"{theme_name} ({mode})",
+                               lambda: self.apply_theme(theme_name, variant=mode),
+                               lambda outcome: on_applied(outcome, state))
+            return False
+        
+        def schedule(reason: str):
+            nonlocal timer
+            reasons.append(reason)
+            if timer is not None:
+                GLib.source_remove(timer)
+            timer = GLib.timeout_add(int(debounce * 1000), flush)
+        
+        def on_file_changed(monitor, file, other_file, event_type, mode):
+            if event_type in (Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                              Gio.FileMonitorEvent.CREATED,
+                              Gio.FileMonitorEvent.MOVED_IN,
+                              Gio.FileMonitorEvent.RENAMED):
+                schedule(f"{mode} wallpaper file changed")
+        
+        def monitor_wallpaper(is_dark: bool):
+            old = monitors.pop(is_dark, None)
+            if old:
+                old.cancel()
+            uri = self.get_gnome_wallpaper_uri(is_dark)
+            if uri and uri != 'none':
+                monitor = Gio.File.new_for_path(uri).monitor_file(Gio.FileMonitorFlags.WATCH_MOVES, None)
+                monitor.connect('changed', on_file_changed, "dark" if is_dark else "light")
+                monitors[is_dark] = monitor
+        
+        def on_interface_changed(settings, key):
+            if key == 'color-scheme':
+                schedule("color scheme changed")
+        
+        def on_background_changed(settings, key):
+            if key in ('picture-uri', 'picture-uri-dark'):
+                is_dark = key == 'picture-uri-dark'
+                monitor_wallpaper(is_dark)
+                schedule(f"{'dark' if is_dark else 'light'} wallpaper URI changed")
+        
+        self.worker = ApplyWorker()
+        try:
+            # Treat the current state as applied so startup does not rebuild
+            last_applied = wanted = desired_state()
+            for is_dark in (False, True):
+                monitor_wallpaper(is_dark)
+            self.settings('org.gnome.desktop.interface').connect('changed', on_interface_changed)
+            self.settings('org.gnome.desktop.background').connect('changed', on_background_changed)
+            
+            loop = GLib.MainLoop()
+            loop.run()
+        except KeyboardInterrupt:
+            print("\nStopped watching")
+        except Exception as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        finally:
+            self.worker.stop()
+            self.worker = None
+    
+    def render_ghostty(self, theme: Dict[str, Any]) -> str:
+        """Render the Ghostty theme file content."""
         colors = theme["colors"]
-        variant = theme.get("variant", "dark")
         
         lines = [f"palette = {i}={color}" for i, color in enumerate(colors["palette"])]
         
@@ -428,87 +2100,34 @@ class ThemeManager:
         for key, ghostty_key in base_mappings.items():
             lines.append(f"{ghostty_key} = {colors['base'][key]}")
         
+        return "\n".join(lines)
+    
+    def update_ghostty(self, theme: Dict[str, Any]) -> bool:
+        """Updates Ghostty theme file."""
+        variant = theme.get("variant", "dark")
+        
         # Determine the theme file path based on variant
         theme_file = self.base_dir / f"ghostty/themes/hypaurora-{variant}"
         theme_file.parent.mkdir(parents=True, exist_ok=True)
         
         with open(theme_file, 'w') as f:
-            f.write("\n".join(lines))
+            f.write(self.render_ghostty(theme))
         
         return True
     
+    def theme_variables(self, theme: Dict[str, Any], mapping: Dict[str, Tuple[str, str]]) -> Dict[str, str]:
+        """Resolve a variable -> (section, key) mapping against a theme's colors."""
+        colors = theme["colors"]
+        return {name: colors[section][key] for name, (section, key) in mapping.items()}
+    
     def update_gtk(self, theme: Dict[str, Any]) -> bool:
         """Updates GTK theme CSS content."""
         self.toggle_gtk_theme(True)
-        colors = theme["colors"]
-        base = colors["base"]
-        semantic = colors["semantic"]
-        ui = colors["ui"]
-        
-        replacements = [
-            (r'(@define-color destructive_bg_color\s+)[^;]+;', 
-            rf'\1{semantic["error"]};'),
-            (r'(@define-color destructive_fg_color\s+)[^;]+;', 
-            rf'\1{base["background"]};'),
-            (r'(@define-color destructive_color\s+)[^;]+;', 
-            rf'\1{semantic["error"]};'),
-            (r'(@define-color success_bg_color\s+)[^;]+;', 
-            rf'\1{semantic["success"]};'),
-            (r'(@define-color success_fg_color\s+)[^;]+;', 
-            rf'\1{base["foreground"]};'),
-            (r'(@define-color success_color\s+)[^;]+;', 
-            rf'\1{semantic["success"]};'),
-            (r'(@define-color warning_bg_color\s+)[^;]+;', 
-            rf'\1{semantic["warning"]};'),
-            (r'(@define-color warning_fg_color\s+)[^;]+;', 
-            rf'\1{base["foreground"]};'),
-            (r'(@define-color warning_color\s+)[^;]+;', 
-            rf'\1{semantic["warning"]};'),
-            (r'(@define-color error_bg_color\s+)[^;]+;', 
-            rf'\1{semantic["error"]};'),
-            (r'(@define-color error_fg_color\s+)[^;]+;', 
-            rf'\1{base["foreground"]};'),
-            (r'(@define-color error_color\s+)[^;]+;', 
-            rf'\1{semantic["error"]};'),
-            (r'(@define-color window_bg_color\s+)[^;]+;', 
-            rf'\1{base["background"]};'),
-            (r'(@define-color window_fg_color\s+)[^;]+;', 
-            rf'\1{base["foreground"]};'),
-            (r'(@define-color view_bg_color\s+)[^;]+;', 
-            rf'\1{base["background"]};'),
-            (r'(@define-color view_fg_color\s+)[^;]+;', 
-            rf'\1{base["foreground"]};'),
-            (r'(@define-color headerbar_bg_color\s+)[^;]+;', 
-            rf'\1{ui["headerbar"]};'),
-            (r'(@define-color headerbar_fg_color\s+)[^;]+;', 
-            rf'\1{ui["headerbar_fg"]};'),
-            (r'(@define-color headerbar_backdrop_color\s+)[^;]+;', 
-            rf'\1{ui["headerbar"]};'),
-            (r'(@define-color headerbar_shade_color\s+)[^;]+;', 
-            rf'\1{ui["headerbar"]};'),
-            (r'(@define-color card_bg_color\s+)[^;]+;', 
-            rf'\1{ui["card"]};'),
-            (r'(@define-color card_fg_color\s+)[^;]+;', 
-            rf'\1{ui["card_fg"]};'),
-            (r'(@define-color card_shade_color\s+)[^;]+;', 
-            rf'\1{ui["card"]};'),
-            (r'(@define-color popover_bg_color\s+)(?!alpha)[^;]+;', 
-            rf'\1{ui["popover"]};'),
-            (r'(@define-color popover_fg_color\s+)[^;]+;', 
-            rf'\1{ui["popover_fg"]};'),
-            (r'(@define-color sidebar_backdrop_color\s+)[^;]+;', 
-            rf'\1{ui["sidebar"]};'),
-            (r'(@define-color sidebar_bg_color\s+)[^;]+;', 
-            rf'\1{ui["sidebar"]};'),
-            (r'(@define-color sidebar_fg_color\s+)[^;]+;', 
-            rf'\1{ui["sidebar_fg"]};'),
-            (r'(@define-color popover_bg_color\s+alpha\()[^)]+(\)[^;]*;)', 
-            rf'\1{ui["popover"]}, 0.6\2'),
-        ]
         
-        self.update_file_with_regex(
-            self.base_dir / "gtk-4.0/themes/hypaurora.css", 
-            replacements
+        self.update_file_from_template(
+            self.base_dir / "gtk-4.0/themes/hypaurora.css",
+            StyleTemplate.GTK,
+            self.theme_variables(theme, self.GTK_COLORS)
         )
 
         self.apply_gtk_theme(theme)
@@ -517,100 +2136,186 @@ class ThemeManager:
     
     def update_gnome_shell(self, theme: Dict[str, Any]) -> bool:
         """Update GNOME Shell color variables."""
-        colors = theme["colors"]
-        base = colors["base"]
-        semantic = colors["semantic"]
-        ui = colors["ui"]
-
         colors_file = (self.base_dir / "gnome-shell-theme" /
                     "gnome-shell-sass" / "_colors-override.scss")
 
-        replacements = [
-            (r'(?m)^\s*\$_base_color_dark\s*:\s*[^;]+;',
-            f'$_base_color_dark: {base["background"]};'),
-            (r'(?m)^\s*\$_base_color_light\s*:\s*[^;]+;',
-            f'$_base_color_light: {base["foreground"]};'),
-            (r'(?m)^\s*\$base_color\s*:\s*[^;]+;',
-            f'$base_color: {base["background"]};'),
-            (r'(?m)^\s*\$bg_color\s*:\s*[^;]+;',
-            f'$bg_color: {base["background"]};'),
-            (r'(?m)^\s*\$fg_color\s*:\s*[^;]+;',
-            f'$fg_color: {base["foreground"]};'),
-            (r'(?m)^\s*\$osd_bg_color\s*:\s*[^;]+;',
-            f'$osd_bg_color: {base["background"]};'),
-            (r'(?m)^\s*\$osd_fg_color\s*:\s*[^;]+;',
-            f'$osd_fg_color: {base["foreground"]};'),
-            (r'(?m)^\s*\$panel_bg_color\s*:\s*[^;]+;',
-            f'$panel_bg_color: {ui["headerbar"]};'),
-            (r'(?m)^\s*\$panel_fg_color\s*:\s*[^;]+;',
-            f'$panel_fg_color: {base["foreground"]};'),
-            (r'(?m)^\s*\$card_bg_color\s*:\s*[^;]+;',
-            f'$card_bg_color: {ui["card"]};'),
-            (r'(?m)^\s*\$system_base_color\s*:\s*[^;]+;',
-            f'$system_base_color: {base["background"]};'),
-            (r'(?m)^\s*\$system_fg_color\s*:\s*[^;]+;',
-            f'$system_fg_color: {base["foreground"]};'),
-            (r'(?m)^\s*\$success_color\s*:\s*[^;]+;',
-            f'$success_color: {semantic["success"]};'),
-            (r'(?m)^\s*\$warning_color\s*:\s*[^;]+;',
-            f'$warning_color: {semantic["warning"]};'),
-            (r'(?m)^\s*\$error_color\s*:\s*[^;]+;',
-            f'$error_color: {semantic["error"]};'),
-            (r'(?m)^\s*\$destructive_color\s*:\s*[^;]+;',
-            f'$destructive_color: {semantic["error"]};'),
-            (r'(?m)^\s*\$selected_bg_color\s*:\s*[^;]+;',
-            f'$selected_bg_color: {base["selection_bg"]};'),
-            (r'(?m)^\s*\$selected_fg_color\s*:\s*[^;]+;',
-            f'$selected_fg_color: {base["selection_fg"]};'),
-        ]
-
-        self.update_file_with_regex(colors_file, replacements)
-        return True
+        changed = self.update_file_from_template(
+            colors_file, StyleTemplate.SCSS, self.theme_variables(theme, self.SHELL_COLORS)
+        )
+        return changed is not None
     
-    def update_file_with_regex(self, file_path: Path, replacements: List[Tuple[str, str]]) -> bool:
-        """Generic method to update file content using regex replacements."""
+    def update_file_from_template(self, file_path: Path, syntax: str,
+                                  values: Dict[str, str]) -> Optional[List[str]]:
+        """Render color variables into a file in one pass.
+        
+        Returns the names of the variables whose value changed (the file is only
+        rewritten if that list is non-empty), or None if the file does not exist.
+        """
         if not file_path.exists():
             print(f"  ⚠ File not found: {file_path}")
-            return False
+            return None
         
-        with open(file_path, 'r') as f:
-            content = f.read()
+        with tracer.span("template", file=file_path.name):
+            template = StyleTemplate.load(file_path, syntax)
+            rendered, changed, missing = template.render(values)
+            if missing:
+                print(f"  ⚠ Variables not found in {file_path.name}: {', '.join(missing)}")
+            
+            if changed:
+                with open(file_path, 'w') as f:
+                    f.write(rendered.text)
+                StyleTemplate.remember(file_path, syntax, rendered)
+            tracer.annotate(changed=len(changed))
         
-        updated_content = content
-        for pattern, replacement in replacements:
-            updated_content = re.sub(pattern, replacement, updated_content, flags=re.DOTALL)
+        return changed
+    
+    @staticmethod
+    def fingerprint(*parts: str) -> str:
+        """Short content hash of rendered target output."""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def render_template_text(self, file_path: Path, syntax: str, values: Dict[str, str]) -> str:
+        """Render color variables into a file's template without writing it."""
+        if not file_path.exists():
+            return ""
+        rendered, _, _ = StyleTemplate.load(file_path, syntax).render(values)
+        return rendered.text
+    
+    def target_fingerprints(self, theme: Dict[str, Any]) -> Dict[str, str]:
+        """Fingerprint the output every target would produce for a theme."""
+        variant = theme.get("variant", "dark")
+        gtk_text = self.render_template_text(
+            self.base_dir / "gtk-4.0/themes/hypaurora.css", StyleTemplate.GTK,
+            self.theme_variables(theme, self.GTK_COLORS)
+        )
+        shell_text = self.render_template_text(
+            self.base_dir / "gnome-shell-theme/gnome-shell-sass/_colors-override.scss",
+            StyleTemplate.SCSS, self.theme_variables(theme, self.SHELL_COLORS)
+        )
+        return {
+            f"ghostty-{variant}": self.fingerprint(self.render_ghostty(theme)),
+            "gtk": self.fingerprint(gtk_text, variant),
+            "gnome-shell": self.fingerprint(shell_text),
+        }
+    
+    def target_installed(self, target: str, theme: Dict[str, Any] = None) -> bool:
+        """Check that a target's output still exists where it was written.
         
-        if updated_content != content:
-            with open(file_path, 'w') as f:
-                f.write(updated_content)
+        For GTK this includes the live color-scheme, which can be changed
+        outside polarify without touching any file.
+        """
+        if target.startswith("ghostty-"):
+            return (self.base_dir / f"ghostty/themes/hypaurora-{target[8:]}").exists()
+        if target == "gtk":
+            gtk_css = self.base_dir / "gtk-4.0/gtk.css"
+            if not gtk_css.exists():
+                return False
+            with open(gtk_css, 'r') as f:
+                if not any(line.strip().startswith("@import") and "themes/hypaurora.css" in line
+                           for line in f):
+                    return False
+            if GNOME_AVAILABLE and theme is not None:
+                try:
+                    scheme = self.settings('org.gnome.desktop.interface').get_string('color-scheme')
+                except Exception:
+                    return False
+                return scheme == self.color_scheme(theme)
             return True
-        
-        return updated_content != content
+        if target == "gnome-shell":
+            return (Path.home() / ".local/share/themes/hypaurora/gnome-shell/gnome-shell.css").exists()
+        return False
+    
+    @staticmethod
+    def color_scheme(theme: Dict[str, Any]) -> str:
+        """GSettings color-scheme value for a theme's variant."""
+        return "prefer-dark" if theme.get("variant", "dark") == "dark" else "default"
     
+    @tracer.traced("gtk_reload")
     def apply_gtk_theme(self, theme: Dict[str, Any], force_update: bool = True):
-        """Apply GTK theme by setting color scheme and toggling high-contrast."""
+        """Apply GTK theme by setting the color scheme and making apps reload their CSS.
+        
+        A color-scheme change already makes libadwaita reload, so the
+        high-contrast toggle is only used when the scheme stays the same (or
+        force_update is set and nothing else changed). Writes are batched with
+        delay()/apply() and each step waits for the change notification
+        instead of sleeping.
+        """
         if not GNOME_AVAILABLE:
             print("Error: Applying GTK theme requires GNOME python library")
             return
         
         try:
-            variant = theme["variant"]
-            color_scheme = "prefer-dark" if variant == "dark" else "default"
+            color_scheme = self.color_scheme(theme)
             
             # Set color scheme
-            settings = Gio.Settings.new('org.gnome.desktop.interface')
-            settings.set_string('color-scheme', color_scheme)
+            with tracer.span("color_scheme"):
+                settings = self.settings('org.gnome.desktop.interface')
+                scheme_changed = settings.get_string('color-scheme') != color_scheme
+                if scheme_changed:
+                    self.write_settings(settings, {'color-scheme': color_scheme})
+                tracer.annotate(changed=scheme_changed)
+            
+            if scheme_changed or not force_update:
+                return
             
-            # Toggle high-contrast to force reload
-            a11y_settings = Gio.Settings.new('org.gnome.desktop.a11y.interface')
-            a11y_settings.set_boolean('high-contrast', True)
-            a11y_settings.sync()
-            time.sleep(0.1)
-            a11y_settings.set_boolean('high-contrast', False)
-            a11y_settings.sync()
+            # Same scheme: toggle high-contrast to force a reload
+            with tracer.span("high_contrast_toggle"):
+                a11y_settings = self.settings('org.gnome.desktop.a11y.interface')
+                original = a11y_settings.get_boolean('high-contrast')
+                flipped = restored = False
+                try:
+                    flipped = self.write_settings(a11y_settings, {'high-contrast': not original})
+                finally:
+                    # Always put the user's setting back, even if the flip was not confirmed
+                    restored = self.write_settings(a11y_settings, {'high-contrast': original})
+                tracer.annotate(notified=flipped and restored)
         except Exception as e:
             print(f"  ⚠ Could not apply GTK CSS changes: {e}")
     
+    @staticmethod
+    def write_settings(settings, values: Dict[str, Any], timeout: float = 0.5) -> bool:
+        """Write keys in one delay()/apply() batch and wait until they are reported changed.
+        
+        Returns False if the change notification did not arrive within timeout.
+        Waits on the notification rather than sleeping: on the main thread the
+        default main context is iterated, on a worker thread the running main
+        loop delivers it.
+        """
+        seen = threading.Event()
+        remaining = set(values)
+        
+        def on_changed(settings, key):
+            remaining.discard(key)
+            if not remaining:
+                seen.set()
+        
+        handler = settings.connect('changed', on_changed)
+        try:
+            settings.delay()
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    settings.set_boolean(key, value)
+                else:
+                    settings.set_string(key, value)
+            settings.apply()
+            settings.sync()
+            
+            deadline = time.monotonic() + timeout
+            context = GLib.MainContext.default()
+            on_main_thread = threading.current_thread() is threading.main_thread()
+            while not seen.is_set() and time.monotonic() < deadline:
+                if on_main_thread and context.pending():
+                    context.iteration(False)
+                else:
+                    seen.wait(0.005 if on_main_thread else deadline - time.monotonic())
+            return seen.is_set()
+        finally:
+            settings.disconnect(handler)
+    
     def apply_gnome_shell_theme(self):
         """Apply GNOME Shell theme by resetting to default and then applying hypaurora."""
         if not self.is_gnome or not GNOME_AVAILABLE:
@@ -645,14 +2350,44 @@ class ThemeManager:
         except Exception as e:
             print(f"  ✗ Error applying GNOME Shell theme: {e}")
     
-    def install_gnome_shell(self, theme: Dict[str, Any]) -> bool:
-        """Build GNOME Shell theme and install to ~/.local/share/themes/hypaurora."""
+    def shell_sources_digest(self) -> str:
+        """Hash the GNOME Shell SCSS tree, excluding the generated color overrides."""
         gnome_shell_dir = self.base_dir / "gnome-shell-theme"
+        digest = hashlib.blake2b(digest_size=20)
+        for path in sorted(gnome_shell_dir.rglob("*.scss")):
+            if path.name == "_colors-override.scss":
+                continue
+            digest.update(str(path.relative_to(gnome_shell_dir)).encode())
+            digest.update((self.file_hashes.digest(path) or "").encode())
+        return digest.hexdigest()
+    
+    @staticmethod
+    def install_file(source: Path, destination: Path):
+        """Place source at destination atomically, hard-linking when possible.
         
-        if not shutil.which("sassc"):
-            print(f"  ⚠ sassc not found. Install it to build GNOME Shell theme:")
-            print(f"     sudo dnf install sassc")
-            return
+        The destination is always replaced rather than written in place, so a
+        hard link never lets later writes reach back into the cache.
+        """
+        tmp = destination.with_name(f".{destination.name}.tmp")
+        try:
+            tmp.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            os.link(source, tmp)
+        except OSError:
+            shutil.copy2(source, tmp)
+        os.replace(tmp, destination)
+    
+    @tracer.traced("install_gnome_shell")
+    def install_gnome_shell(self, theme: Dict[str, Any]) -> bool:
+        """Build GNOME Shell theme and install to ~/.local/share/themes/hypaurora.
+        
+        Compiled CSS is cached by a hash of the color overrides and the SCSS
+        sources, so palettes that were built before skip sassc entirely.
+        """
+        gnome_shell_dir = self.base_dir / "gnome-shell-theme"
+        colors_file = gnome_shell_dir / "gnome-shell-sass" / "_colors-override.scss"
         
         if not self.update_gnome_shell(theme):
             print(f"  ⚠ Could not update GNOME Shell theme colors")
@@ -660,19 +2395,43 @@ class ThemeManager:
         
         custom_scss = gnome_shell_dir / "gnome-shell-hypaurora.scss"
         output_css = gnome_shell_dir / "gnome-shell.css"
-        try:
-            subprocess.run(["sassc", "-a", str(custom_scss), str(output_css)],
-                         check=True, capture_output=True, text=True)
-        except subprocess.CalledProcessError as e:
-            print(f"  ✗ Failed to build GNOME Shell CSS:")
-            print(f"    {e.stderr}")
-            return
         
-        theme_install_dir = Path.home() / ".local/share/themes/hypaurora/gnome-shell"
-        theme_install_dir.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(output_css, theme_install_dir / "gnome-shell.css")
+        with tracer.span("cache_lookup"):
+            with open(colors_file, 'r') as f:
+                key = DiskCache.make_key(f.read(), self.shell_sources_digest())
+            cached_css = self.shell_css_cache.get_file(key, ".css")
+            tracer.annotate(hit=cached_css is not None)
+        
+        if cached_css:
+            with tracer.span("install", file=output_css.name):
+                self.install_file(cached_css, output_css)
+        else:
+            if not shutil.which("sassc"):
+                print(f"  ⚠ sassc not found. Install it to build GNOME Shell theme:")
+                print(f"     sudo dnf install sassc")
+                return
+            # Build next to the output: gnome-shell.css may be a hard link into the cache
+            build_css = gnome_shell_dir / ".gnome-shell.css.build"
+            try:
+                with tracer.span("sassc"):
+                    subprocess.run(["sassc", "-a", str(custom_scss), str(build_css)],
+                                 check=True, capture_output=True, text=True)
+            except subprocess.CalledProcessError as e:
+                print(f"  ✗ Failed to build GNOME Shell CSS:")
+                print(f"    {e.stderr}")
+                return
+            with tracer.span("cache_store"):
+                self.shell_css_cache.put_file(key, build_css, ".css")
+                os.replace(build_css, output_css)
+            cached_css = output_css
+        
+        with tracer.span("install", file="~/.local/share/themes/hypaurora"):
+            theme_install_dir = Path.home() / ".local/share/themes/hypaurora/gnome-shell"
+            theme_install_dir.mkdir(parents=True, exist_ok=True)
+            self.install_file(cached_css, theme_install_dir / "gnome-shell.css")
 
-        self.apply_gnome_shell_theme()
+        with tracer.span("shell_settings"):
+            self.apply_gnome_shell_theme()
         
         return True
     
@@ -785,11 +2544,12 @@ class ThemeManager:
         except Exception as e:
             print(f"  ✗ Error resetting GNOME Shell theme: {e}")
     
+    @tracer.traced("generate_wallpaper_theme")
     def generate_wallpaper_theme(self, variant: str = None, wallpaper_path: str = None) -> Dict[str, Any]:
         """Generate theme from wallpaper image."""
         if not IMAGING_AVAILABLE:
             print("Error: PIL (Pillow) and numpy are required for wallpaper theme generation")
-            print("Install with: pip install Pillow numpy scikit-learn")
+            print("Install with: pip install Pillow numpy (scikit-learn is optional)")
             sys.exit(1)
         
         # Auto-detect variant from GNOME if not specified
@@ -806,24 +2566,31 @@ class ThemeManager:
             else:
                 wallpaper_path = str(Path.home() / ".config/background")
         
+        if wallpaper_path:
+            wallpaper_path = uri_to_path(str(wallpaper_path))
         if not wallpaper_path or not Path(wallpaper_path).exists():
             raise FileNotFoundError(f"Wallpaper not found at {wallpaper_path}")
         
-        print(f"Generating {variant} theme from wallpaper: {wallpaper_path}")
-        theme = ImageThemeGenerator.generate_theme_from_image(
-            str(wallpaper_path), theme_name="wallpaper", variant=variant
-        )
+        theme = self.wallpaper_analysis(wallpaper_path)["themes"][variant]
         
-        self.themes_dir.mkdir(parents=True, exist_ok=True)
-        theme_file = self.themes_dir / "wallpaper.json"
-        with open(theme_file, 'w') as f:
-            json.dump(theme, f, indent=2)
+        with tracer.span("write"):
+            self.themes_dir.mkdir(parents=True, exist_ok=True)
+            theme_file = self.themes_dir / "wallpaper.json"
+            with open(theme_file, 'w') as f:
+                json.dump(theme, f, indent=2)
         
         print(f"  ✓ Saved wallpaper theme to {theme_file}")
         return theme
 
+    def checkpoint(self):
+        """Let a background worker drop an apply that a newer event superseded."""
+        if self.worker is not None:
+            self.worker.checkpoint()
+    
+    @tracer.traced("apply_theme")
     def apply_theme(self, theme_name: str, variant: str = None):
         """Apply theme across all applications."""
+        tracer.annotate(theme=theme_name)
         if theme_name == "wallpaper":
             theme = self.generate_wallpaper_theme(variant=variant)
         elif theme_name == "adwaita":
@@ -831,7 +2598,11 @@ class ThemeManager:
         elif theme_name == "adwaita-dark":
             theme = self.get_adwaita_theme(variant="dark")
         else:
-            theme = self.load_theme(theme_name)
+            with tracer.span("load"):
+                theme = self.load_theme(theme_name)
+        
+        # Generation is the slow part; do not write anything if a newer event arrived meanwhile
+        self.checkpoint()
         
         print(f"Applying theme: {theme['name']}")
         print("=" * 50)
@@ -844,52 +2615,381 @@ class ThemeManager:
         is_current_adwaita = current_theme in ["adwaita", "adwaita-dark"]
         is_destination_adwaita = theme_name in ["adwaita", "adwaita-dark"]
         both_adwaita = is_current_adwaita and is_destination_adwaita
+        
+        # Recolor open terminals in place with --live, or "live_terminals" in the config
+        live = self.live if self.live is not None else bool(config.get("live_terminals", False))
 
         if theme_name == "adwaita" or theme_name == "adwaita-dark":
             # Special handling for Adwaita (resetting themes)
             
             # Only reset GTK and GNOME Shell if not already using Adwaita
             if not both_adwaita:
-                # 1. Update Ghostty with Adwaita colors
-                self.update_ghostty(theme)
-                print("  ✓ Updated Ghostty (Adwaita)")
+                def reset_gtk():
+                    # Disable custom theme import, then apply color scheme (dark/light) and reload
+                    self.toggle_gtk_theme(False)
+                    self.apply_gtk_theme(theme)
                 
-                # 2. Reset GTK (Disable custom theme import)
-                self.toggle_gtk_theme(False)
-                # Apply color scheme (dark/light) and reload
-                self.apply_gtk_theme(theme)
-                print("  ✓ Reset GTK to Adwaita")
+                pipeline = TargetPipeline()
+                pipeline.add("Ghostty", lambda: self.update_ghostty(theme))
+                pipeline.add("GTK", reset_gtk)
+                pipeline.add("GNOME Shell", self.reset_gnome_shell_theme)
+                if live:
+                    pipeline.add("Terminals", lambda: TerminalRecolor.push(theme))
+                results = pipeline.run()
+                self._report_targets(results, {
+                    "Ghostty": "Updated Ghostty (Adwaita)",
+                    "GTK": "Reset GTK to Adwaita",
+                    "GNOME Shell": "Reset GNOME Shell to default",
+                    **self._terminal_labels(results),
+                })
                 
-                # 3. Reset GNOME Shell (Use default theme)
-                self.reset_gnome_shell_theme()
-                print("  ✓ Reset GNOME Shell to default")
+                # GTK and Shell no longer show the rendered output
+                fingerprints = config.setdefault("fingerprints", {})
+                fingerprints.pop("gtk", None)
+                fingerprints.pop("gnome-shell", None)
+                fingerprints.pop(f"ghostty-{theme['variant']}", None)
             else:
+                results = {}
                 print("  ✓ Skipped Ghostty, Shell and GTK themes (already using Adwaita)")
             
         else:
             config_updates = [
-                ("Ghostty", lambda: self.update_ghostty(theme)),
-                ("GTK", lambda: self.update_gtk(theme)),
-                ("GNOME Shell", lambda: self.install_gnome_shell(theme)),
+                ("Ghostty", f"ghostty-{theme['variant']}", lambda: self.update_ghostty(theme)),
+                ("GTK", "gtk", lambda: self.update_gtk(theme)),
+                ("GNOME Shell", "gnome-shell", lambda: self.install_gnome_shell(theme)),
             ]
             
-            for name, update_fn in config_updates:
-                update_fn()
-                print(f"  ✓ Updated {name}")
+            # Skip targets whose rendered output matches what was last applied
+            fingerprints = config.setdefault("fingerprints", {})
+            with tracer.span("fingerprint"):
+                rendered = self.target_fingerprints(theme)
+            
+            # The targets are independent, so they run concurrently
+            pipeline = TargetPipeline()
+            targets = {}
+            for name, target, update_fn in config_updates:
+                if fingerprints.get(target) == rendered[target] and self.target_installed(target, theme):
+                    print(f"  ✓ {name} unchanged, skipped")
+                    continue
+                targets[name] = target
+                pipeline.add(name, update_fn)
+            if live:
+                pipeline.add("Terminals", lambda: TerminalRecolor.push(theme))
+            
+            results = pipeline.run()
+            for name, outcome in results.items():
+                if name not in targets:
+                    continue
+                if outcome["ok"] and outcome["result"]:
+                    fingerprints[targets[name]] = rendered[targets[name]]
+                else:
+                    fingerprints.pop(targets[name], None)
+            self._report_targets(results, {**{name: f"Updated {name}" for name in results},
+                                           **self._terminal_labels(results)})
         
         config["current_theme"] = theme_name
-        self.save_config(config)
+        with tracer.span("save_config"):
+            self.save_config(config)
         
-        print("\n✓ Theme applied successfully!\n")
+        if any(not outcome["ok"] for outcome in results.values()):
+            print("\n⚠ Theme applied with errors\n")
+        else:
+            print("\n✓ Theme applied successfully!\n")
         print("To reload applications:")
-        print("  • Ghostty: Use Ctrl+Shift+,")
+        if "Terminals" in results:
+            print("  • Ghostty: Open terminals were recolored, use Ctrl+Shift+, for new windows")
+        else:
+            print("  • Ghostty: Use Ctrl+Shift+,")
         print("  • GTK: Adwaita applications will reload automatically, Restart GTK3 applications")
+        return results
+    
+    @staticmethod
+    def _terminal_labels(results: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+        outcome = results.get("Terminals")
+        if not outcome or not outcome["ok"]:
+            return {}
+        return {"Terminals": f"Recolored {outcome['result']} open terminals"}
+    
+    def _report_targets(self, results: Dict[str, Dict[str, Any]], labels: Dict[str, str]):
+        """Print one status line per pipeline target, in declared order."""
+        for name, outcome in results.items():
+            if outcome["ok"]:
+                print(f"  ✓ {labels[name]} ({outcome['seconds'] * 1000:.0f} ms)")
+            else:
+                print(f"  ✗ Failed to update {name}: {outcome['error']}")
 
+    def find_similar_themes(self, colors: List[Tuple[str, float]], variant: str = None,
+                            top: int = 5) -> List[Tuple[str, float]]:
+        """Rank registry themes by perceptual distance to weighted colors.
+        
+        The score is a symmetric chamfer distance in OKLab, computed as one
+        (colors x themes x palette) distance tensor: each input color is matched to
+        its nearest theme color (weighted by its share), and each theme's background,
+        foreground and accent to their nearest input color. Lower is closer.
+        """
+        names, variants, tensor = self.registry.palette_tensor()
+        # The generated wallpaper theme is not a curated match
+        keep = [i for i, v in enumerate(variants)
+                if (variant is None or v == variant) and names[i] != "wallpaper"]
+        if not keep or not colors:
+            return []
+        
+        query = ColorSpace.srgb_to_oklab(ColorEngine.to_array([color for color, _ in colors]))
+        weights = np.array([weight for _, weight in colors], dtype=np.float64)
+        weights = weights / weights.sum()
+        
+        themes = tensor[keep]
+        distances = np.linalg.norm(query[:, None, None, :] - themes[None, :, :, :], axis=3)
+        coverage = (distances.min(axis=2) * weights[:, None]).sum(axis=0)
+        fidelity = distances[:, :, :3].min(axis=0).mean(axis=1)
+        scores = coverage + 0.5 * fidelity
+        
+        order = np.argsort(scores, kind="stable")[:top]
+        return [(names[keep[i]], float(scores[i])) for i in order]
+    
+    def match_theme(self, target: str, variant: str = None, top: int = 5, apply: bool = False):
+        """Print the bundled themes closest to an image or color(s), optionally applying the best."""
+        if not IMAGING_AVAILABLE:
+            print("Error: PIL (Pillow) and numpy are required for theme matching")
+            print("Install with: pip install Pillow numpy (scikit-learn is optional)")
+            sys.exit(1)
+        
+        if re.fullmatch(r'#?[0-9A-Fa-f]{6}(,#?[0-9A-Fa-f]{6})*', target):
+            colors = [(f"#{color.lstrip('#').lower()}", 1.0) for color in target.split(',')]
+        else:
+            image_path = uri_to_path(target)
+            if not Path(image_path).exists():
+                raise FileNotFoundError(f"Image not found at {image_path}")
+            colors = self.wallpaper_analysis(image_path)["palette"]
+        
+        matches = self.find_similar_themes(colors, variant=variant, top=top)
+        if not matches:
+            print("No matching themes found")
+            return
+        
+        print(f"Closest themes to {target}:\n")
+        for rank, (name, score) in enumerate(matches, 1):
+            print(f"  {rank}. {name:40s} {score:.4f}")
+        print()
+        
+        if apply:
+            self.apply_theme(matches[0][0])
+    
+    def audit_themes(self, themes: List[str] = None, variant: str = None,
+                     as_json: bool = False, fix: bool = False) -> bool:
+        """Report (and optionally fix) WCAG contrast violations across the registry.
+        
+        Returns True when no violations are left.
+        """
+        if not _available('numpy'):
+            print("Error: numpy is required for the contrast audit")
+            print("Install with: pip install numpy")
+            sys.exit(1)
+        
+        names = self.registry.query(variant=variant)
+        if themes:
+            for name in themes:
+                if name not in names:
+                    self.load_theme(name)
+            names = [name for name in names if name in themes]
+        
+        start = time.perf_counter()
+        audit = ContrastAudit(self.registry)
+        violations = audit.run(names)
+        written = audit.fix(violations) if fix else 0
+        remaining = [v for v in violations if "fixed" not in v]
+        elapsed = time.perf_counter() - start
+        
+        if as_json:
+            print(json.dumps({
+                "themes": len(names),
+                "checks": len(ContrastAudit.CHECKS),
+                "seconds": round(elapsed, 4),
+                "violations": violations,
+            }, indent=2))
+            return not remaining
+        
+        if violations:
+            print(f"{'Theme':<32} {'Check':<11} {'Colors':<20} {'Ratio':>6} {'Min':>5}")
+            for v in violations:
+                colors = f"{v['fg']} on {v['bg']}"
+                line = f"{v['theme']:<32} {v['check']:<11} {colors:<20} {v['ratio']:6.2f} {v['min']:5.1f}"
+                if "fixed" in v:
+                    line += f"  → {v['fixed']}"
+                elif v.get("unreachable"):
+                    line += "  (unreachable)"
+                print(line)
+            print()
+        
+        themes_hit = len({v["theme"] for v in violations})
+        summary = f"{len(names)} themes × {len(ContrastAudit.CHECKS)} checks in {elapsed * 1000:.0f} ms"
+        if not violations:
+            print(f"✓ No contrast violations ({summary})")
+        elif fix:
+            print(f"✓ Fixed {len(violations) - len(remaining)} of {len(violations)} violations "
+                  f"in {written} theme files ({summary})")
+            if remaining:
+                print(f"  ⚠ {len(remaining)} could not reach their ratio")
+        else:
+            print(f"⚠ {len(violations)} violations in {themes_hit} themes ({summary})")
+            print("  Run with --fix to adjust the foreground colors")
+        return not remaining
+    
+    def wallpaper_params(self) -> Dict[str, Any]:
+        """Generation parameters that are part of every wallpaper cache key.
+        
+        The palette extractor comes from --extractor, else wallpaper_extractor
+        in the config, else the default. Its options (such as the kmeans
+        max_iter and time_budget) come from wallpaper_extractor_options, keyed
+        by extractor name.
+        """
+        import inspect
+        
+        config = self.load_config()
+        method = self.extractor or config.get("wallpaper_extractor")
+        if method not in PALETTE_EXTRACTORS:
+            if method:
+                print(f"  ⚠ Unknown palette extractor '{method}', using {self.WALLPAPER_PARAMS['method']}")
+            method = self.WALLPAPER_PARAMS["method"]
+        
+        options = dict((config.get("wallpaper_extractor_options") or {}).get(method) or {})
+        accepted = list(inspect.signature(PALETTE_EXTRACTORS[method]).parameters)[2:]
+        for name in [name for name in options if name not in accepted]:
+            print(f"  ⚠ Ignoring unknown {method} option '{name}' (accepted: {', '.join(accepted) or 'none'})")
+            del options[name]
+        return dict(self.WALLPAPER_PARAMS, method=method, options=options, version=self.GENERATOR_VERSION)
+    
+    def wallpaper_key(self, digest: str, params: Dict[str, Any] = None) -> str:
+        """Cache key of an image's analysis; both variants live in the one entry."""
+        return DiskCache.make_key(digest, params or self.wallpaper_params())
+    
+    @staticmethod
+    def analyze_wallpaper(image_path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Analyse an image once and derive every variant, as a cache entry."""
+        palette = WallpaperPalette.from_image(image_path, params["n_colors"], params["method"],
+                                              **params.get("options", {}))
+        with tracer.span("derive"):
+            themes = palette.derive_all()
+        return {
+            "image": str(image_path),
+            "params": params,
+            "palette": palette.to_json(),
+            "themes": themes,
+        }
+    
+    def wallpaper_analysis(self, image_path: str) -> Dict[str, Any]:
+        """Palette and dark/light themes of an image, from the cache when possible."""
+        params = self.wallpaper_params()
+        with tracer.span("hash"):
+            digest = self.file_hashes.digest(image_path)
+        with tracer.span("cache_lookup"):
+            key = self.wallpaper_key(digest, params)
+            cached = self.theme_cache.get(key)
+            tracer.annotate(hit=cached is not None)
+        
+        if cached and all(variant in cached.get("themes", {}) for variant in WallpaperPalette.VARIANTS):
+            print(f"Using cached themes for wallpaper: {image_path}")
+            return cached
+        
+        print(f"Generating themes from wallpaper: {image_path}")
+        entry = self.analyze_wallpaper(image_path, params)
+        with tracer.span("cache_store"):
+            self.theme_cache.put(key, entry)
+        return entry
+    
+    @staticmethod
+    def pregen_worker(image_path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """analyze_wallpaper for a worker process, with contrast warnings silenced."""
+        with contextlib.redirect_stdout(io.StringIO()):
+            return ThemeManager.analyze_wallpaper(image_path, params)
+    
+    def pregen(self, directory: str, jobs: int = None):
+        """Generate wallpaper themes for every image under directory into the cache.
+        
+        Images are identified by content hash, so renamed or duplicated files
+        and images generated before are skipped. Clustering runs in a process
+        pool; results are written to the wallpaper theme cache, where
+        `apply wallpaper` and the watchers find them.
+        """
+        if not IMAGING_AVAILABLE:
+            print("Error: PIL (Pillow) and numpy are required for wallpaper theme generation")
+            print("Install with: pip install Pillow numpy (scikit-learn is optional)")
+            sys.exit(1)
+        
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        
+        root = Path(directory).expanduser()
+        if not root.is_dir():
+            raise FileNotFoundError(f"Wallpaper directory not found: {root}")
+        
+        images = sorted(path for path in root.rglob("*")
+                        if path.suffix.lower() in self.WALLPAPER_EXTENSIONS and path.is_file())
+        params = self.wallpaper_params()
+        
+        # One job per distinct image content not in the cache yet
+        todo: Dict[str, Path] = {}
+        cached = 0
+        for path in images:
+            digest = self.file_hashes.digest(path)
+            if digest is None or digest in todo:
+                continue
+            if self.theme_cache.get_file(self.wallpaper_key(digest, params), ".json"):
+                cached += 1
+            else:
+                todo[digest] = path
+        
+        if len(images) > self.theme_cache.max_entries:
+            print(f"  ⚠ {len(images)} images exceed the cache size ({self.theme_cache.max_entries} entries); "
+                  f"the oldest themes will be evicted")
+        
+        jobs = max(1, min(jobs or os.cpu_count() or 1, len(todo) or 1))
+        print(f"Pre-generating themes for {len(todo)} of {len(images)} images "
+              f"in {root} ({cached} cached, {jobs} workers, {params['method']} extractor)\n")
+        
+        start = time.perf_counter()
+        generated = failed = 0
+        if todo:
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = {pool.submit(self.pregen_worker, str(path), params): (digest, path)
+                           for digest, path in todo.items()}
+                for future in as_completed(futures):
+                    digest, path = futures[future]
+                    try:
+                        entry = future.result()
+                    except Exception as e:
+                        failed += 1
+                        print(f"  ✗ {path.relative_to(root)}: {e}")
+                        continue
+                    self.theme_cache.put(self.wallpaper_key(digest, params), entry)
+                    generated += 1
+                    print(f"  ✓ {path.relative_to(root)}")
+        
+        elapsed = time.perf_counter() - start
+        print(f"\n✓ Generated {generated}, skipped {cached} cached, {failed} failed in {elapsed:.1f}s")
+        return failed == 0
+    
+    def cache_stats(self):
+        """Print cache usage."""
+        caches = [("Wallpaper themes", self.theme_cache),
+                  ("GNOME Shell CSS", self.shell_css_cache)]
+        print("Polarify cache:\n")
+        for title, cache in caches:
+            stats = cache.stats()
+            print(f"  {title}")
+            print(f"    Path:    {stats['path']}")
+            print(f"    Entries: {stats['entries']} / {stats['max_entries']}")
+            print(f"    Size:    {stats['bytes'] / 1024:.1f} KiB / {stats['max_bytes'] // (1024 * 1024)} MiB")
+    
+    def cache_clear(self):
+        """Remove every cache entry."""
+        removed = self.theme_cache.clear() + self.shell_css_cache.clear()
+        print(f"✓ Removed {removed} cache entries")
+    
     def watch_wallpaper(self, variant: str = None, check_interval: float = 2.0):
         """Watch wallpaper for changes and auto-apply theme."""
         if not IMAGING_AVAILABLE:
             print("Error: PIL (Pillow) and numpy are required for wallpaper theme generation")
-            print("Install with: pip install Pillow numpy scikit-learn")
+            print("Install with: pip install Pillow numpy (scikit-learn is optional)")
             sys.exit(1)
         
         if self.is_gnome and GNOME_AVAILABLE:
@@ -899,111 +2999,105 @@ class ThemeManager:
         self._watch_wallpaper_file(variant, check_interval)
     
     def _watch_wallpaper_gnome(self):
-        """Watch GNOME wallpaper settings for changes."""
+        """Watch GNOME wallpaper settings and files for changes."""
         print("👁️  Watching GNOME wallpaper for changes...")
         print("Press Ctrl+C to stop\n")
         
-        last_uri_light = None
-        last_uri_dark = None
-        last_hash_light = None
-        last_hash_dark = None
-        file_stable_time = {}
-        
-        def get_file_hash(path: str) -> Optional[str]:
-            """Get MD5 hash of file."""
-            if not path or not Path(path).exists():
-                return None
-            try:
-                with open(path, 'rb') as f:
-                    return hashlib.md5(f.read()).hexdigest()
-            except (IOError, PermissionError):
-                return None
-        
-        def check_and_apply_theme(uri: str, is_dark: bool):
-            """Check if wallpaper changed and apply theme if needed."""
-            nonlocal last_hash_light, last_hash_dark
-            
+        # (mode, wallpaper signature) last applied, and of the newest submitted apply so
+        # repeats of it are not resubmitted; a mode flip changes both
+        last_applied = None
+        wanted = None
+        monitors = {}
+        pending = {}
+        
+        def on_applied(outcome, state):
+            nonlocal last_applied, wanted
+            if outcome["ok"]:
+                last_applied = state
+                print("\n✓ Theme applied successfully!\n")
+            elif outcome["cancelled"]:
+                print("   Dropped, superseded by a newer wallpaper\n")
+            else:
+                print(f"✗ Error applying theme: {outcome['error']}\n")
+            if not outcome["ok"] and not outcome["stale"]:
+                wanted = last_applied
+        
+        def check_and_apply_theme(is_dark: bool):
+            """Apply a new theme if the active mode or its wallpaper content changed."""
+            nonlocal wanted
+            pending.pop(is_dark, None)
+            if is_dark != self.get_gnome_dark_mode():
+                return False  # Only the wallpaper of the active mode drives the theme
+            uri = self.get_gnome_wallpaper_uri(is_dark)
             if not uri or uri == 'none':
-                return
-            
-            current_time = time.time()
-            try:
-                mtime = Path(uri).stat().st_mtime
-                last_change = file_stable_time.get(uri, 0)
-                
-                if current_time - mtime < 2.0:
-                    file_stable_time[uri] = current_time
-                    return
-                
-                if current_time - last_change < 2.0:
-                    return
-                
-            except (FileNotFoundError, OSError):
-                return
+                return False
             
-            current_hash = get_file_hash(uri)
-            if not current_hash:
-                return
+            mode = "dark" if is_dark else "light"
+            state = (mode, self.file_hashes.signature(uri))
+            if not state[1] or state == wanted:
+                return False
             
-            last_hash = last_hash_dark if is_dark else last_hash_light
+            print(f"🎨 Wallpaper or mode changed ({mode} mode) at {time.strftime('%H:%M:%S')}")
+            print(f"   Path: {uri}")
+            print("   Generating and applying new theme...\n")
             
-            if current_hash != last_hash:
-                mode = "dark" if is_dark else "light"
-                print(f"🎨 Wallpaper changed ({mode} mode) at {time.strftime('%H:%M:%S')}")
-                print(f"   Path: {uri}")
-                print("   Generating and applying new theme...\n")
-                
-                try:
-                    self.apply_theme("wallpaper", variant=mode)
-                    if is_dark:
-                        last_hash_dark = current_hash
-                    else:
-                        last_hash_light = current_hash
-                    print("\n✓ Theme applied successfully!\n")
-                except Exception as e:
-                    print(f"✗ Error applying theme: {e}\n")
+            # Generation runs off the main loop; a newer wallpaper supersedes it
+            wanted = state
+            self.worker.submit(f"wallpaper ({mode})",
+                               lambda: self.apply_theme("wallpaper", variant=mode),
+                               lambda outcome: on_applied(outcome, state))
+            return False
+        
+        def schedule_check(is_dark: bool):
+            # Coalesce bursts of file events into one check
+            if is_dark not in pending:
+                pending[is_dark] = GLib.timeout_add(500, check_and_apply_theme, is_dark)
+        
+        def on_file_changed(monitor, file, other_file, event_type, is_dark):
+            if event_type in (Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                              Gio.FileMonitorEvent.CREATED,
+                              Gio.FileMonitorEvent.MOVED_IN,
+                              Gio.FileMonitorEvent.RENAMED):
+                schedule_check(is_dark)
+        
+        def monitor_wallpaper(is_dark: bool):
+            """(Re)attach a file monitor to the wallpaper of the given mode."""
+            old = monitors.pop(is_dark, None)
+            if old:
+                old.cancel()
+            uri = self.get_gnome_wallpaper_uri(is_dark)
+            if not uri or uri == 'none':
+                return
+            monitor = Gio.File.new_for_path(uri).monitor_file(Gio.FileMonitorFlags.WATCH_MOVES, None)
+            monitor.connect('changed', on_file_changed, is_dark)
+            monitors[is_dark] = monitor
         
         def on_background_changed(settings, key):
-            nonlocal last_uri_light, last_uri_dark
-            
             if key in ['picture-uri', 'picture-uri-dark']:
                 is_dark = key == 'picture-uri-dark'
-                uri = self.get_gnome_wallpaper_uri(is_dark)
-                
-                last_uri = last_uri_dark if is_dark else last_uri_light
-                
-                if uri != last_uri:
-                    mode = "dark" if is_dark else "light"
-                    print(f"🖼️  GNOME wallpaper URI changed ({mode} mode)")
-                    if is_dark:
-                        last_uri_dark = uri
-                    else:
-                        last_uri_light = uri
-                    check_and_apply_theme(uri, is_dark)
+                mode = "dark" if is_dark else "light"
+                print(f"🖼️  GNOME wallpaper URI changed ({mode} mode)")
+                monitor_wallpaper(is_dark)
+                schedule_check(is_dark)
         
-        def periodic_check():
-            """Periodically check file hashes for current mode."""
-            dark_mode = self.get_gnome_dark_mode()
-            uri = self.get_gnome_wallpaper_uri(dark_mode)
-            check_and_apply_theme(uri, dark_mode)
-            return True
+        def on_color_scheme_changed(settings, key):
+            # The other mode's wallpaper (and variant) takes over
+            schedule_check(self.get_gnome_dark_mode())
         
+        self.worker = ApplyWorker()
         try:
-            settings = Gio.Settings.new('org.gnome.desktop.background')
-            
-            last_uri_light = self.get_gnome_wallpaper_uri(False)
-            last_uri_dark = self.get_gnome_wallpaper_uri(True)
-            dark_mode = self.get_gnome_dark_mode()
-            current_uri = last_uri_dark if dark_mode else last_uri_light
+            settings = self.settings('org.gnome.desktop.background')
             
-            if current_uri:
-                if dark_mode:
-                    last_hash_dark = get_file_hash(current_uri)
-                else:
-                    last_hash_light = get_file_hash(current_uri)
+            for is_dark in (False, True):
+                monitor_wallpaper(is_dark)
+            is_dark = self.get_gnome_dark_mode()
+            uri = self.get_gnome_wallpaper_uri(is_dark)
+            if uri:
+                last_applied = wanted = ("dark" if is_dark else "light", self.file_hashes.signature(uri))
             
             settings.connect('changed', on_background_changed)
-            GLib.timeout_add_seconds(2, periodic_check)
+            self.settings('org.gnome.desktop.interface').connect('changed::color-scheme',
+                                                                 on_color_scheme_changed)
             
             loop = GLib.MainLoop()
             loop.run()
@@ -1012,9 +3106,16 @@ class ThemeManager:
         except Exception as e:
             print(f"Error: {e}")
             sys.exit(1)
+        finally:
+            self.worker.stop()
+            self.worker = None
     
     def _watch_wallpaper_file(self, variant: str = "dark", check_interval: float = 2.0):
-        """Watch wallpaper file for changes (non-GNOME fallback)."""
+        """Watch wallpaper file for changes (non-GNOME fallback).
+        
+        Uses inotify on the wallpaper's directory when available and falls back to
+        stat polling. Either way the file is only hashed when its stat changes.
+        """
         wallpaper_path = Path.home() / ".config/background"
         
         if not wallpaper_path.exists():
@@ -1024,81 +3125,290 @@ class ThemeManager:
         print("Press Ctrl+C to stop\n")
         
         last_hash = None
-        last_mtime = None
-        stable_count = 0
-        required_stable_checks = 3
-        
-        def get_file_hash(path: Path) -> Optional[str]:
-            """Get MD5 hash of file."""
-            if not path.exists():
-                return None
-            try:
-                with open(path, 'rb') as f:
-                    return hashlib.md5(f.read()).hexdigest()
-            except (IOError, PermissionError):
-                return None
+        watcher = None
+        try:
+            watcher = InotifyWatcher()
+            watcher.add(wallpaper_path.parent)
+        except OSError as e:
+            print(f"  ⚠ inotify unavailable ({e}), polling every {check_interval:g}s")
+            watcher = None
+        
+        def targets() -> set:
+            paths = {wallpaper_path}
+            if wallpaper_path.is_symlink():
+                resolved = wallpaper_path.resolve()
+                paths.add(resolved)
+                if watcher:
+                    watcher.add(resolved.parent)
+            return paths
         
         try:
+            first = True
             while True:
-                if not wallpaper_path.exists():
-                    time.sleep(check_interval)
-                    continue
-                
-                try:
-                    current_mtime = wallpaper_path.stat().st_mtime
-                    
-                    if last_mtime is None or current_mtime != last_mtime:
-                        last_mtime = current_mtime
-                        stable_count = 0
+                if not first:
+                    if watcher:
+                        watched = targets()
+                        if not watched & watcher.read():
+                            continue
+                        # Let bursts of writes settle before hashing
+                        while watched & watcher.read(timeout=0.5):
+                            pass
+                    else:
                         time.sleep(check_interval)
-                        continue
-                    
-                    stable_count += 1
-                    
-                    if stable_count >= required_stable_checks:
-                        current_hash = get_file_hash(wallpaper_path)
-                        
-                        if current_hash and current_hash != last_hash:
-                            print(f"🎨 Wallpaper changed detected at {time.strftime('%H:%M:%S')}")
-                            print("   Generating and applying new theme...\n")
-                            
-                            try:
-                                self.apply_theme("wallpaper", variant=variant)
-                                last_hash = current_hash
-                                print("\n✓ Theme applied successfully!\n")
-                            except Exception as e:
-                                print(f"✗ Error applying theme: {e}\n")
-                        
-                        stable_count = required_stable_checks
-                
-                except (IOError, PermissionError):
-                    stable_count = 0
+                first = False
                 
-                time.sleep(check_interval)
+                current_hash = self.file_hashes.digest(wallpaper_path)
+                if current_hash and current_hash != last_hash:
+                    print(f"🎨 Wallpaper changed detected at {time.strftime('%H:%M:%S')}")
+                    print("   Generating and applying new theme...\n")
+                    
+                    try:
+                        self.apply_theme("wallpaper", variant=variant)
+                        last_hash = current_hash
+                        print("\n✓ Theme applied successfully!\n")
+                    except Exception as e:
+                        print(f"✗ Error applying theme: {e}\n")
         
         except KeyboardInterrupt:
             print("\nStopped watching wallpaper")
+        finally:
+            if watcher:
+                watcher.close()
 
 
-def main():
+class _SocketWriter(io.TextIOBase):
+    """Text stream that forwards writes to a daemon client as JSON lines."""
+    
+    def __init__(self, conn: socket.socket, stream: str, lock):
+        self.conn = conn
+        self.stream = stream
+        self.lock = lock
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, text: str) -> int:
+        if text:
+            message = json.dumps({self.stream: text}).encode() + b"\n"
+            with self.lock:
+                try:
+                    self.conn.sendall(message)
+                except OSError:
+                    pass  # Client went away, keep running the command
+        return len(text)
+
+
+class PolarifyDaemon:
+    """Serve CLI commands from a warm process over a Unix socket.
+    
+    The daemon keeps one ThemeManager alive: imports, the theme registry,
+    template parses, file hashes and GSettings handles stay loaded between
+    commands. Clients send one JSON line with their argv and working
+    directory, and receive their stdout/stderr and exit code as JSON lines.
+    """
+    
+    FORWARDED_COMMANDS = ('apply', 'list', 'preview', 'match')
+    # Seconds a client may take to send its request, and the daemon to accept it
+    REQUEST_TIMEOUT = 2.0
+    
+    def __init__(self, manager: "ThemeManager", parser: argparse.ArgumentParser):
+        self.manager = manager
+        self.parser = parser
+    
+    @staticmethod
+    def socket_path() -> Path:
+        runtime = os.environ.get('XDG_RUNTIME_DIR')
+        if runtime:
+            return Path(runtime) / "polarify.sock"
+        return Path(tempfile.gettempdir()) / f"polarify-{os.getuid()}.sock"
+    
+    @classmethod
+    def forward(cls, argv: List[str], connect_timeout: float = 0.2) -> Optional[int]:
+        """Run argv in the daemon; return its exit code, or None if it did not take the request.
+        
+        A daemon that is unreachable, busy or hung until REQUEST_TIMEOUT gets
+        None so the command runs in-process. Once the daemon has answered, the
+        command is its to finish: a dropped stream is an error, never a rerun.
+        """
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        accepted = False
+        try:
+            conn.settimeout(connect_timeout)
+            conn.connect(str(cls.socket_path()))
+            conn.settimeout(cls.REQUEST_TIMEOUT)
+            request = {"argv": argv, "cwd": os.getcwd()}
+            conn.sendall(json.dumps(request).encode() + b"\n")
+            
+            for line in conn.makefile('r', encoding='utf-8'):
+                if not accepted:
+                    accepted = True
+                    conn.settimeout(None)
+                message = json.loads(line)
+                if "stdout" in message:
+                    sys.stdout.write(message["stdout"])
+                elif "stderr" in message:
+                    sys.stderr.write(message["stderr"])
+                elif "exit" in message:
+                    sys.stdout.flush()
+                    return message["exit"]
+        except (OSError, ValueError):
+            pass
+        finally:
+            conn.close()
+        if not accepted:
+            return None
+        sys.stdout.flush()
+        print("Error: Lost connection to the polarify daemon before the command finished", file=sys.stderr)
+        return 1
+    
+    def serve(self):
+        """Listen on the socket until interrupted."""
+        path = self.socket_path()
+        if self.forward_probe(path):
+            print(f"Error: A polarify daemon is already listening on {path}", file=sys.stderr)
+            sys.exit(1)
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(str(path))
+        finally:
+            os.umask(old_umask)
+        server.listen(8)
+        
+        print(f"🛰️  Polarify daemon listening on {path}")
+        print("Press Ctrl+C to stop\n")
+        sys.stdout.flush()
+        
+        # Warm up the registry so the first request is already fast
+        self.manager.registry.load()
+        
+        try:
+            while True:
+                ready, _, _ = select.select([server], [], [], 1.0)
+                if ready:
+                    conn, _ = server.accept()
+                    with conn:
+                        self.handle(conn)
+                self.pump_events()
+        except KeyboardInterrupt:
+            print("\nStopped polarify daemon")
+        finally:
+            server.close()
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+    
+    @staticmethod
+    def forward_probe(path: Path) -> bool:
+        """Check whether something is accepting connections on path."""
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(str(path))
+            return True
+        except OSError:
+            return False
+        finally:
+            probe.close()
+    
+    @staticmethod
+    def pump_events():
+        """Dispatch pending GLib events (GSettings change notifications) between requests."""
+        if GNOME_AVAILABLE:
+            context = GLib.MainContext.default()
+            while context.pending():
+                context.iteration(False)
+    
+    def handle(self, conn: socket.socket):
+        """Run one client request with its output streamed back."""
+        # An idle client must not hold up everyone queued behind it
+        conn.settimeout(self.REQUEST_TIMEOUT)
+        try:
+            request = json.loads(conn.makefile('r', encoding='utf-8').readline())
+            argv = list(request["argv"])
+            conn.sendall(json.dumps({"accepted": True}).encode() + b"\n")
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        
+        lock = threading.Lock()
+        stdout = _SocketWriter(conn, "stdout", lock)
+        stderr = _SocketWriter(conn, "stderr", lock)
+        cwd = os.getcwd()
+        code = 0
+        try:
+            os.chdir(request.get("cwd") or cwd)
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                try:
+                    args = self.parser.parse_args(argv)
+                    if args.command in self.FORWARDED_COMMANDS and not getattr(args, 'listen', False):
+                        code = run_command(self.manager, args)
+                    else:
+                        print(f"Error: '{args.command}' cannot run in the daemon", file=sys.stderr)
+                        code = 1
+                except SystemExit as e:
+                    code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except OSError as e:
+            stderr.write(f"Error: {e}\n")
+            code = 1
+        finally:
+            os.chdir(cwd)
+        
+        with lock:
+            try:
+                conn.sendall(json.dumps({"exit": code}).encode() + b"\n")
+            except OSError:
+                pass
+
+
+def add_extractor_argument(parser: argparse.ArgumentParser):
+    parser.add_argument('--extractor', choices=list(PALETTE_EXTRACTORS), default=None,
+                        help='Palette extraction backend for wallpaper themes '
+                             '(default: wallpaper_extractor in theme-config.json, else kmeans)')
+
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="Hypaurora Theme Manager",
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 Examples:
   %(prog)s list                                List all themes
+  %(prog)s list --variant light                List light themes only
   %(prog)s preview bearded_arc                 Preview theme colors
   %(prog)s apply bearded_monokai_stone         Apply theme
   %(prog)s apply wallpaper                     Generate and apply theme from wallpaper
   %(prog)s apply wallpaper --variant light     Generate light theme from wallpaper
   %(prog)s apply wallpaper --listen            Watch wallpaper and auto-apply theme
+  %(prog)s apply catppuccin_mocha --live       Apply and recolor open terminals immediately
   %(prog)s watch-dark-mode                     Watch GNOME dark mode and auto-switch themes
+  %(prog)s watch                               Watch dark mode and wallpaper in one process
+  %(prog)s match ~/Pictures/wall.jpg --apply   Apply the bundled theme closest to an image
+  %(prog)s pregen ~/Pictures/Wallpapers        Pre-generate themes for a wallpaper folder
+  %(prog)s audit --fix                         Fix contrast problems in the bundled themes
+  %(prog)s cache stats                         Show theme cache usage
+  %(prog)s daemon                              Keep polarify warm for fast apply/list/preview
         """
     )
     
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='Run in this process even if a polarify daemon is running')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Report import and run times on stderr when the command finishes')
+    parser.add_argument('--trace', choices=Tracer.FORMATS, default=os.environ.get('POLARIFY_TRACE') or None,
+                        help='Print per-stage timings of applies on stderr (default: $POLARIFY_TRACE)')
+    
     subparsers = parser.add_subparsers(dest='command', help='Commands')
     
-    subparsers.add_parser('list', help='List all available themes')
+    list_parser = subparsers.add_parser('list', help='List all available themes')
+    list_parser.add_argument('--variant', choices=['dark', 'light'], default=None,
+                             help='Only list dark or light themes')
+    list_parser.add_argument('--author', default=None,
+                             help='Only list themes whose author contains this text')
     
     preview_parser = subparsers.add_parser('preview', help='Preview theme colors')
     preview_parser.add_argument('theme', help='Theme name to preview')
@@ -1109,41 +3419,137 @@ Examples:
                              help='Theme variant (for wallpaper theme generation, auto-detected on GNOME)')
     apply_parser.add_argument('--listen', action='store_true',
                              help='Watch wallpaper file for changes (only for wallpaper theme)')
+    apply_parser.add_argument('--live', action='store_true', default=None,
+                             help='Recolor open terminals in place with OSC sequences '
+                                  '(default: live_terminals in theme-config.json)')
+    add_extractor_argument(apply_parser)
     
     subparsers.add_parser('watch-dark-mode', 
                          help='Watch GNOME dark mode and auto-switch themes (GNOME only)')
     
-    args = parser.parse_args()
+    watch_parser = subparsers.add_parser('watch',
+                                         help='Watch dark mode and wallpaper together and auto-apply (GNOME only)')
+    watch_parser.add_argument('--debounce', type=float, default=0.75,
+                              help='Seconds to wait for more events before applying (default: 0.75)')
     
-    if not args.command:
-        parser.print_help()
-        return
+    match_parser = subparsers.add_parser('match', help='Find bundled themes closest to an image or color')
+    match_parser.add_argument('target', help='Image path/URI or hex color(s), e.g. "#1e1e2e,#cba6f7"')
+    match_parser.add_argument('--variant', choices=['dark', 'light'], default=None,
+                              help='Only consider dark or light themes')
+    match_parser.add_argument('--top', type=int, default=5, help='Number of matches to show')
+    match_parser.add_argument('--apply', action='store_true', help='Apply the closest theme')
+    add_extractor_argument(match_parser)
     
-    manager = ThemeManager(base_dir=Path("~/Documents/hypaurora").expanduser())
+    pregen_parser = subparsers.add_parser('pregen', help='Pre-generate wallpaper themes for a folder of images')
+    pregen_parser.add_argument('directory', help='Wallpaper folder (searched recursively)')
+    pregen_parser.add_argument('--jobs', '-j', type=int, default=None,
+                               help='Worker processes (default: number of CPUs)')
+    add_extractor_argument(pregen_parser)
+    
+    audit_parser = subparsers.add_parser('audit', help='Check every theme for WCAG contrast violations')
+    audit_parser.add_argument('themes', nargs='*', help='Only audit these themes (default: all)')
+    audit_parser.add_argument('--variant', choices=['dark', 'light'], default=None,
+                              help='Only audit dark or light themes')
+    audit_parser.add_argument('--json', action='store_true', help='Print violations as JSON')
+    audit_parser.add_argument('--fix', action='store_true',
+                              help='Rewrite failing foreground colors to the nearest passing color')
+    
+    cache_parser = subparsers.add_parser('cache', help='Inspect or clear the wallpaper theme and GNOME Shell CSS caches')
+    cache_parser.add_argument('action', choices=['stats', 'clear'], help='Cache action')
+    
+    subparsers.add_parser('daemon', help='Serve commands from a warm process over a Unix socket')
     
+    return parser
+
+
+def run_command(manager: "ThemeManager", args: argparse.Namespace) -> int:
+    """Dispatch a parsed command and return its exit code."""
+    tracer.configure(args.trace)
+    manager.extractor = getattr(args, 'extractor', None)
+    manager.live = getattr(args, 'live', None)
+    if manager.extractor == 'sklearn' and not _available('sklearn'):
+        print("Error: the sklearn extractor needs scikit-learn (pip install scikit-learn)", file=sys.stderr)
+        return 1
     try:
         if args.command == 'list':
-            manager.list_themes()
+            manager.list_themes(variant=args.variant, author=args.author)
         elif args.command == 'preview':
             manager.preview_theme(args.theme)
         elif args.command == 'apply':
             if args.listen:
                 if args.theme != "wallpaper":
                     print("Error: --listen can only be used with 'wallpaper' theme")
-                    sys.exit(1)
+                    return 1
                 manager.watch_wallpaper(variant=args.variant)
             else:
                 manager.apply_theme(args.theme, variant=args.variant)
         elif args.command == 'watch-dark-mode':
             manager.watch_gnome_dark_mode()
+        elif args.command == 'watch':
+            manager.watch(debounce=args.debounce)
+        elif args.command == 'match':
+            manager.match_theme(args.target, variant=args.variant, top=args.top, apply=args.apply)
+        elif args.command == 'pregen':
+            if not manager.pregen(args.directory, jobs=args.jobs):
+                return 1
+        elif args.command == 'audit':
+            if not manager.audit_themes(args.themes, variant=args.variant, as_json=args.json, fix=args.fix):
+                return 1
+        elif args.command == 'cache':
+            if args.action == 'stats':
+                manager.cache_stats()
+            else:
+                manager.cache_clear()
     except FileNotFoundError as e:
         print(f"Error: {e}", file=sys.stderr)
-        sys.exit(1)
+        return 1
     except Exception as e:
         print(f"Unexpected error: {e}", file=sys.stderr)
         import traceback
         traceback.print_exc()
-        sys.exit(1)
+        return 1
+    return 0
+
+
+def report_startup():
+    """Print where startup time went (module imports, lazy dependencies, command)."""
+    now = time.perf_counter()
+    print("⏱  Startup profile:", file=sys.stderr)
+    print(f"  module imports  {(_IMPORTED - _STARTED) * 1000:8.1f} ms", file=sys.stderr)
+    for name, seconds in _LazyModule.loaded.items():
+        print(f"  lazy {name:<10} {seconds * 1000:8.1f} ms", file=sys.stderr)
+    if not _LazyModule.loaded:
+        print("  lazy imports         none", file=sys.stderr)
+    print(f"  total           {(now - _STARTED) * 1000:8.1f} ms", file=sys.stderr)
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    
+    if not args.command:
+        parser.print_help()
+        return
+    
+    if args.profile_startup:
+        atexit.register(report_startup)
+    
+    # Prefer a running daemon for short commands, fall back to running here
+    if (args.command in PolarifyDaemon.FORWARDED_COMMANDS and not args.no_daemon
+            and not getattr(args, 'listen', False)):
+        code = PolarifyDaemon.forward(sys.argv[1:])
+        if code is not None:
+            sys.exit(code)
+    
+    manager = ThemeManager(base_dir=Path("~/Documents/hypaurora").expanduser())
+    
+    if args.command == 'daemon':
+        PolarifyDaemon(manager, parser).serve()
+        return
+    
+    code = run_command(manager, args)
+    if code:
+        sys.exit(code)
 
 
 if __name__ == "__main__":
@@ -5,11 +5,14 @@ SERVICE_NAME="polarify-watch.service"
 SERVICE_FILE="$(dirname "$0")/$SERVICE_NAME"
 SYSTEMD_USER_DIR="$HOME/.config/systemd/user"
 
-echo "Installing Polarify Dark Mode Watcher service..."
+echo "Installing Polarify Dark Mode and Wallpaper Watcher service..."
 
 # Create systemd user directory if it doesn't exist
 mkdir -p "$SYSTEMD_USER_DIR"
 
+# Create the cache directory so the sandboxed service can write to it
+mkdir -p "$HOME/.cache/polarify"
+
 # Copy service file
 cp "$SERVICE_FILE" "$SYSTEMD_USER_DIR/"
 echo "✓ Copied service file to $SYSTEMD_USER_DIR"